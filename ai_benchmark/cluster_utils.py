@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019-2020 by Andrey Ignatov. All Rights Reserved.
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+import requests
+
+from ai_benchmark.io_utils import json_default
+
+DEFAULT_PORT = 8642
+# Seconds a worker keeps trying to reach a coordinator that is not up yet
+CONNECT_TIMEOUT = 60
+CONNECT_RETRY_INTERVAL = 1
+REQUEST_TIMEOUT = 30
+# A job is handed out again if its worker sent no heartbeat for LEASE_TIMEOUT seconds
+LEASE_TIMEOUT = 60
+HEARTBEAT_INTERVAL = 10
+SCORE_SCALE = 10000
+# Run settings naming files of the coordinator host, each worker uses its own
+LOCAL_SETTINGS = ("profile", "data_store", "graph_cache", "journal", "resume")
+
+logger = logging.getLogger('ai_benchmark')
+
+
+def get_score(norms):
+    # Geometric mean of the normalized results, as in print_scores
+    norms = [norm for norm in norms if norm is not None and np.isfinite(norm)]
+    if not norms:
+        return 0
+    return int(np.exp(np.mean(np.log(norms))) * SCORE_SCALE)
+
+
+def get_job_config(config):
+    ignored = [name for name in LOCAL_SETTINGS if config.get(name)]
+    if ignored:
+        logger.warning("Coordinator: ignoring %s, set them on the workers", ", ".join(ignored))
+    return dict((name, value) for name, value in config.items() if name not in LOCAL_SETTINGS)
+
+
+class CoordinatorServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server whose close waits for the responses being sent, e.g. the last one telling a worker it is done"""
+    # Python 3.6 has no ThreadingHTTPServer, and does not join the request threads on close:
+    # there, the non-daemon threads still finish their response before the process exits
+    daemon_threads = False
+
+
+class Coordinator:
+    """Hands out (test id, config) jobs to the worker agents and aggregates their results per worker"""
+    def __init__(self, test_ids, config, workers=1, distribute=False, lease_timeout=LEASE_TIMEOUT):
+        self.test_ids = list(test_ids)
+        self.config = get_job_config(config)
+        self.workers = workers
+        # Every worker runs all the tests, unless they are distributed between the workers
+        self.distribute = distribute
+        self.lease_timeout = lease_timeout
+        self.queues = {}
+        self.pending = {}
+        self.hosts = {}
+        self.finished = set()
+        self.lost = set()
+        self.job_count = 0
+        self.condition = threading.Condition()
+        self.server = None
+
+    def get_queue(self, worker):
+        key = None if self.distribute else worker
+        if key not in self.queues:
+            self.queues[key] = list(self.test_ids)
+        return self.queues[key]
+
+    def register(self, host):
+        # Workers sharing a name, e.g. several on one host, are told apart by a suffix
+        with self.condition:
+            worker, count = host, 1
+            while worker in self.hosts:
+                count += 1
+                worker = "%s-%d" % (host, count)
+            self.hosts[worker] = {"environment": None, "test_results": {}, "inference_norm": [],
+                                  "training_norm": [], "failed_tests": {}}
+            logger.info("Coordinator: worker %s registered", worker)
+            return {"worker": worker}
+
+    def next_job(self, worker):
+        with self.condition:
+            self.expire_leases()
+            queue = self.get_queue(worker)
+            if not queue or worker in self.lost:
+                self.finished.add(worker)
+                self.condition.notify_all()
+                return {"done": True}
+
+            self.job_count += 1
+            job = {"id": self.job_count, "test_id": queue.pop(0), "config": self.config}
+            self.pending[job["id"]] = {"worker": worker, "test_id": job["test_id"],
+                                       "expires": time.monotonic() + self.lease_timeout}
+            logger.info("Job %d: test %s on %s", job["id"], job["test_id"], worker)
+            return {"job": job}
+
+    def renew_lease(self, job_id):
+        with self.condition:
+            if job_id in self.pending:
+                self.pending[job_id]["expires"] = time.monotonic() + self.lease_timeout
+
+    def expire_leases(self):
+        # The worker of an expired job is given up on: its test is handed out again, or reported as failed
+        # when every worker runs its own copy of the tests
+        with self.condition:
+            now = time.monotonic()
+            expired = [job_id for job_id, lease in self.pending.items() if lease["expires"] <= now]
+            for job_id in expired:
+                lease = self.pending.pop(job_id)
+                worker = lease["worker"]
+                self.lost.add(worker)
+                logger.warning("Job %d: no heartbeat from %s for %d s, the worker is given up on", job_id, worker,
+                               self.lease_timeout)
+                queue = self.get_queue(worker)
+                if self.distribute:
+                    queue.insert(0, lease["test_id"])
+                else:
+                    for test_id in [lease["test_id"]] + queue:
+                        self.hosts[worker]["failed_tests"][test_id] = "Worker lost"
+                    del queue[:]
+            if expired:
+                self.condition.notify_all()
+
+    def add_result(self, result):
+        with self.condition:
+            lease = self.pending.pop(result["job_id"], None)
+            if lease is None:
+                logger.warning("Coordinator: ignoring the result of unknown job %s", result["job_id"])
+                return
+            worker = lease["worker"]
+            entry = self.hosts[worker]
+            entry["environment"] = result["environment"]
+            if result["error"] is not None:
+                logger.warning("Job %d: test %s failed on %s: %s", result["job_id"], result["test_id"], worker,
+                               result["error"])
+                entry["failed_tests"][result["test_id"]] = result["error"]
+            else:
+                entry["test_results"].update(result["test_results"])
+                entry["inference_norm"].extend(result["inference_norm"])
+                entry["training_norm"].extend(result["training_norm"])
+            self.condition.notify_all()
+
+    def is_done(self):
+        # Every worker has been told that there is nothing left to run, or has been given up on
+        stopped = self.finished | self.lost
+        return not self.pending and len(stopped) >= self.workers and stopped == set(self.hosts)
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while not self.is_done():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    logger.warning("Coordinator: timed out with %d jobs running", len(self.pending))
+                    break
+                # Woken up by the workers, and at least once a second to expire the leases
+                self.condition.wait(1 if remaining is None else min(remaining, 1))
+                self.expire_leases()
+            not_run = sum(len(queue) for queue in self.queues.values())
+            if not_run:
+                logger.warning("Coordinator: %d tests were not run, no worker was left to take them", not_run)
+            return self.get_results()
+
+    def get_results(self):
+        results = {}
+        for host, entry in self.hosts.items():
+            inference_score = get_score(entry["inference_norm"])
+            training_score = get_score(entry["training_norm"])
+            results[host] = {
+                "environment": entry["environment"],
+                "test_results": entry["test_results"],
+                "failed_tests": entry["failed_tests"],
+                "inference_score": inference_score,
+                "training_score": training_score,
+                "ai_score": inference_score + training_score,
+            }
+        return results
+
+    def start(self, host="0.0.0.0", port=DEFAULT_PORT):
+        self.server = CoordinatorServer((host, port), get_request_handler(self))
+        thread = threading.Thread(target=self.server.serve_forever, name="ai-benchmark-coordinator", daemon=True)
+        thread.start()
+        return self.server.server_address[1]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def serve(self, host="0.0.0.0", port=DEFAULT_PORT, timeout=None):
+        port = self.start(host, port)
+        logger.info("Coordinator: waiting for %d workers on port %d", self.workers, port)
+        try:
+            return self.wait(timeout)
+        finally:
+            self.stop()
+
+
+def get_request_handler(coordinator):
+
+    class RequestHandler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/register":
+                self.send_json(coordinator.register(body["host"]))
+            elif self.path == "/job":
+                self.send_json(coordinator.next_job(body["worker"]))
+            elif self.path == "/heartbeat":
+                coordinator.renew_lease(body["job_id"])
+                self.send_json({})
+            elif self.path == "/result":
+                coordinator.add_result(body)
+                self.send_json({})
+            else:
+                self.send_error(404)
+
+        def send_json(self, data):
+            output = json.dumps(data, default=json_default).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(output)))
+            self.end_headers()
+            self.wfile.write(output)
+
+        def log_message(self, format, *args):
+            logger.debug("Coordinator: " + format, *args)
+
+    return RequestHandler
+
+
+def get_job_result(job, test_info, public_results, environment):
+    return {
+        "job_id": job["id"],
+        "test_id": job["test_id"],
+        "environment": environment,
+        "test_results": dict((public_id, vars(result)) for public_id, result in public_results.test_results.items()),
+        "inference_norm": test_info.results.results_inference_norm,
+        "training_norm": test_info.results.results_training_norm,
+        "error": None,
+    }
+
+
+def post(url, data, connect_timeout=0):
+    # The coordinator may still be starting: connection errors are retried for connect_timeout seconds
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            response = requests.post(url, data=json.dumps(data, default=json_default),
+                                     headers={"Content-Type": "application/json"}, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+        except requests.ConnectionError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(CONNECT_RETRY_INTERVAL)
+
+
+class Heartbeat:
+    """Keeps the lease of a running job, until the job is done"""
+    def __init__(self, coordinator_url, job_id, interval=HEARTBEAT_INTERVAL):
+        self.coordinator_url = coordinator_url
+        self.job_id = job_id
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.run, name="ai-benchmark-heartbeat", daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                post(self.coordinator_url + "/heartbeat", {"job_id": self.job_id})
+            except requests.RequestException as err:
+                logger.debug("Job %d: heartbeat failed: %s", self.job_id, err)
+
+
+def run_worker(coordinator_url, run_job, environment, host=None, connect_timeout=CONNECT_TIMEOUT,
+               heartbeat_interval=HEARTBEAT_INTERVAL):
+
+    # The process id tells apart the workers started on the same host
+    host = host or "%s:%d" % (socket.gethostname(), os.getpid())
+    coordinator_url = coordinator_url.rstrip("/")
+    if "://" not in coordinator_url:
+        coordinator_url = "http://" + coordinator_url
+
+    worker = post(coordinator_url + "/register", {"host": host}, connect_timeout)["worker"]
+    jobs = 0
+    while True:
+        response = post(coordinator_url + "/job", {"worker": worker})
+        if response.get("done"):
+            logger.info("Worker %s: %d jobs done", worker, jobs)
+            return jobs
+
+        job = response["job"]
+        try:
+            with Heartbeat(coordinator_url, job["id"], heartbeat_interval):
+                result = run_job(job)
+        except Exception as err:
+            logger.warning("Job %d: test %s failed: %s", job["id"], job["test_id"], err)
+            result = {"job_id": job["id"], "test_id": job["test_id"], "environment": environment,
+                      "error": "%s: %s" % (type(err).__name__, err)}
+        post(coordinator_url + "/result", result)
+        jobs += 1
+
+
+def print_cluster_results(results):
+    for host, entry in results.items():
+        logger.info("\n%s", host)
+        for public_id, result in entry["test_results"].items():
+            logger.info("%s - %s: %.1f ms", host, public_id, result["mean"])
+        for test_id, error in entry["failed_tests"].items():
+            logger.info("%s - test %s failed: %s", host, test_id, error)
+        logger.info("%s - AI Score: %d (inference %d, training %d)", host, entry["ai_score"],
+                    entry["inference_score"], entry["training_score"])
@@ -2,13 +2,39 @@
 import argparse
 import json
 from ai_benchmark import config
+from ai_benchmark import tune_utils
+from ai_benchmark import graph_utils
+from ai_benchmark import serving_utils
+from ai_benchmark import cluster_utils
+from ai_benchmark import journal_utils
+from ai_benchmark.io_utils import json_default
 
 TEST_IDS = [str(t.id) for t in config.BENCHMARK_TESTS]
+MODES = ('run', 'tune', 'compare', 'sweep', 'load', 'batching', 'coordinator', 'worker')
+
+def grappler_option(value):
+    name, _, toggle = value.partition('=')
+    if name not in graph_utils.GRAPPLER_OPTIMIZERS or toggle not in graph_utils.GRAPPLER_TOGGLES:
+        raise argparse.ArgumentTypeError(
+            "expected OPTIMIZER=TOGGLE with OPTIMIZER in %s and TOGGLE in %s" % (
+                ", ".join(graph_utils.GRAPPLER_OPTIMIZERS), ", ".join(graph_utils.GRAPPLER_TOGGLES)))
+    return name, toggle
+
 
 class MainArgumentParser(argparse.ArgumentParser):
     """Parser with AI Benchmark arguments"""
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.add_argument(
+            'mode', default='run', nargs='?', choices=MODES,
+            help="run: run the benchmark, tune: find the best thread settings of each test and save them to --profile, "
+                 "compare: run the tests without and with --xla / --grappler (XLA if none is set) and report the speedup, "
+                 "sweep: run the inference tests over a range of batch sizes and report the throughput curves, "
+                 "load: send Poisson arrivals to the inference tests over a range of offered QPS and report the latency curves, "
+                 "batching: serve single-sample Poisson arrivals with dynamic batching policies and report their throughput and latency, "
+                 "coordinator: hand out the tests to --agents workers and aggregate their results per host, "
+                 "worker: run the tests handed out by --coordinator",
+        )
         self.add_argument(
             '-c', '--use-cpu', default=None, action='store_true',
             help='Run the tests on CPUs  (if tensorflow-gpu is installed)'
@@ -53,6 +79,182 @@ class MainArgumentParser(argparse.ArgumentParser):
             '-t', '--test-ids', default=None, nargs='+', choices=TEST_IDS,
             help="Select test by ID, all by default",
         )
+        self.add_argument(
+            '--cache-size', default=None, type=float,
+            help="Memory cap of the preprocessed data cache in MB, 0 disables caching",
+        )
+        self.add_argument(
+            '--data-store', default=None, type=str,
+            help="Directory of the persistent preprocessed data store, disabled by default",
+        )
+        self.add_argument(
+            '--prepare-data', action='store_true',
+            help="Fill the data store for the selected tests and exit",
+        )
+        self.add_argument(
+            '--prefetch', default=0, type=int,
+            help="Number of batches prepared in background while the model runs, 0 disables prefetching",
+        )
+        self.add_argument(
+            '--synthetic', action='store_true',
+            help="Feed seeded random float32 data instead of the bundled images, to measure compute only",
+        )
+        self.add_argument(
+            '--reject-outliers', action='store_true',
+            help="Drop iterations with a MAD-based modified z-score above 3.5 from the statistics",
+        )
+        self.add_argument(
+            '--detect-warmup', action='store_true',
+            help="Detect the warmup iterations with the MSER rule instead of only dropping the first one. "
+                 "Changes the means and the scores, which are comparable with the reference results without it",
+        )
+        self.add_argument(
+            '-a', '--adaptive', action='store_true',
+            help="Iterate each test until the confidence interval of the mean is narrow enough",
+        )
+        self.add_argument(
+            '--target-ci', default=0.05, type=float,
+            help="Adaptive mode: target width of the 95%% confidence interval relative to the mean",
+        )
+        self.add_argument(
+            '--time-budget', default=None, type=float,
+            help="Adaptive mode: time budget per test in seconds, max_duration of the test by default",
+        )
+        self.add_argument(
+            '--input-mode', default='feed', type=str, choices=('feed', 'graph'),
+            help="feed: feed_dict on every iteration, graph: stage each batch into the graph once and time only its execution",
+        )
+        self.add_argument(
+            '--graph-cache', default=None, type=str,
+            help="Directory of the on-disk cache of parsed model graphs, disabled by default",
+        )
+        self.add_argument(
+            '--frozen', action='store_true',
+            help="Inference-only runs (-T 0): run frozen graphs pruned to the output, cached in --graph-cache",
+        )
+        self.add_argument(
+            '--engine', default='session', type=str, choices=graph_utils.ENGINES,
+            help="Inference-only runs (-T 0): session: tf.compat.v1.Session with feeds, "
+                 "function: frozen graphs called as TF2 concrete functions with eager tensors. The function engine "
+                 "applies -c (CPU placement), -b/-B once per process, --xla and the on/off Grappler toggles, "
+                 "but not tune or --profile. Tests that cannot be frozen, and every test on TF1, fall back to sessions",
+        )
+        self.add_argument(
+            '--xla', action='store_true',
+            help="Compile the graphs with the XLA JIT (global_jit_level=ON_1)",
+        )
+        self.add_argument(
+            '--grappler', default=None, type=grappler_option, nargs='+', metavar='OPTIMIZER=TOGGLE',
+            help="Grappler rewriter settings, e.g. layout=off remapping=on constant_folding=off arithmetic=aggressive",
+        )
+        self.add_argument(
+            '--workers', default=1, type=int,
+            help="Number of processes running the tests in parallel, each pinned to its own share of the CPUs",
+        )
+        self.add_argument(
+            '--iteration-timeout', default=None, type=float,
+            help="Deadline of each iteration in seconds: a subtest with a slower iteration is reported as timed out "
+                 "and left out of the scores, unlimited by default. The rest of a test is skipped while a call "
+                 "that could not be cancelled still runs, --isolate also stops it with the test process. "
+                 "Not available with --streams, load and batching",
+        )
+        self.add_argument(
+            '--journal', default=None, type=str,
+            help="Append every finished subtest to this journal file, so that an interrupted run can be resumed",
+        )
+        self.add_argument(
+            '--resume', action='store_true',
+            help="Skip the tests already in the journal (%s by default) for this system and these settings"
+                 % journal_utils.DEFAULT_JOURNAL,
+        )
+        self.add_argument(
+            '--isolate', action='store_true',
+            help="Run every test in a new process, skipping the tests that crash, time out or run out of memory",
+        )
+        self.add_argument(
+            '--memory-limit', default=None, type=float,
+            help="Isolated runs: memory limit of each test process in MB, unlimited by default",
+        )
+        self.add_argument(
+            '--test-timeout', default=None, type=float,
+            help="Isolated runs: wall-clock limit of each test in seconds, unlimited by default",
+        )
+        self.add_argument(
+            '--streams', default=1, type=int,
+            help="Number of concurrent inference streams running the same session, each with its own input batch",
+        )
+        self.add_argument(
+            '--batch-sizes', default=None, type=int, nargs='+',
+            help="Sweep: batch sizes to run, powers of two up to twice the batch size of each test by default",
+        )
+        self.add_argument(
+            '--qps', default=None, type=float, nargs='+',
+            help="Load: offered request rates, 10%% to 120%% of the closed-loop capacity of each test by default. "
+                 "Batching: single-sample request rate, 80%% of the closed-loop throughput of each test by default",
+        )
+        self.add_argument(
+            '--load-duration', default=None, type=float,
+            help="Load, batching: seconds of arrivals generated per offered rate (%g by default) or batching policy "
+                 "(%g by default)" % (serving_utils.DEFAULT_LOAD_DURATION, serving_utils.DEFAULT_BATCHING_DURATION),
+        )
+        self.add_argument(
+            '--max-batch', default=None, type=int, nargs='+',
+            help="Batching: maximum batch sizes of the policies, powers of four up to the batch size of each test by default",
+        )
+        self.add_argument(
+            '--batch-timeout', default=None, type=float, nargs='+',
+            help="Batching: maximum queueing delays of the policies in ms, %s by default" % ", ".join(
+                str(timeout) for timeout in serving_utils.DEFAULT_BATCH_TIMEOUTS),
+        )
+        self.add_argument(
+            '--coordinator', default=None, type=str, metavar='HOST:PORT',
+            help="Worker: address of the coordinator",
+        )
+        self.add_argument(
+            '--worker-name', default=None, type=str,
+            help="Worker: name the results are aggregated under, host name:process id by default",
+        )
+        self.add_argument(
+            '--host', default='0.0.0.0', type=str,
+            help="Coordinator: address to listen on",
+        )
+        self.add_argument(
+            '--port', default=cluster_utils.DEFAULT_PORT, type=int,
+            help="Coordinator: port to listen on",
+        )
+        self.add_argument(
+            '--agents', default=1, type=int,
+            help="Coordinator: number of workers to wait for",
+        )
+        self.add_argument(
+            '--distribute', action='store_true',
+            help="Coordinator: split the tests between the workers instead of running all of them on every worker",
+        )
+        self.add_argument(
+            '--cluster-timeout', default=None, type=float,
+            help="Coordinator: seconds to wait for the workers before reporting the results collected so far",
+        )
+        self.add_argument(
+            '--profile', default=None, type=str,
+            help="Thread profile file: written by tune (%s by default), applied to the tests by run" % tune_utils.DEFAULT_PROFILE,
+        )
+        self.add_argument(
+            '--profile-objective', default='throughput', type=str, choices=tune_utils.OBJECTIVES,
+            help="Thread settings of the profile to apply: best latency or best throughput",
+        )
+        self.add_argument(
+            '--tune-cores', default=None, type=int, nargs='+',
+            help="Tune: CPU core counts to sweep, the tests of each candidate are pinned to as many CPUs. "
+                 "Only --cpu-cores (all cores by default) if not set",
+        )
+        self.add_argument(
+            '--tune-inter', default=None, type=int, nargs='+',
+            help="Tune: inter_op_parallelism_threads values to sweep, 1, 2, 4, 8 up to the core count by default",
+        )
+        self.add_argument(
+            '--tune-intra', default=None, type=int, nargs='+',
+            help="Tune: intra_op_parallelism_threads values to sweep, powers of two up to twice the core count by default",
+        )
         self.add_argument(
             '-j', '--json', action='store_true',
             help="Output results as JSON",
@@ -73,7 +275,65 @@ def main():
         verbose_level=parsed_args.verbose,
         seed=parsed_args.seed,
     )
-    test_info, results = benchmark.run(
+    if parsed_args.prepare_data:
+        if parsed_args.data_store is None:
+            parser.error("--prepare-data requires --data-store")
+        benchmark.prepare_data_store(parsed_args.data_store, test_ids=parsed_args.test_ids)
+        return
+
+    if parsed_args.engine == 'function' and (parsed_args.mode == 'tune' or parsed_args.profile is not None):
+        parser.error("--engine function cannot apply per-test thread settings (tune, --profile)")
+
+    if parsed_args.mode == 'tune':
+        tuned = benchmark.tune(
+            profile=parsed_args.profile or tune_utils.DEFAULT_PROFILE,
+            test_ids=parsed_args.test_ids,
+            cpu_cores=parsed_args.cpu_cores,
+            core_counts=parsed_args.tune_cores,
+            inter_threads=parsed_args.tune_inter,
+            intra_threads=parsed_args.tune_intra,
+            time_budget=parsed_args.time_budget or tune_utils.DEFAULT_TUNE_BUDGET,
+            cache_size=parsed_args.cache_size,
+            data_store=parsed_args.data_store,
+            prefetch=parsed_args.prefetch,
+            synthetic=parsed_args.synthetic,
+            outlier_rejection=parsed_args.reject_outliers,
+            detect_warmup=parsed_args.detect_warmup,
+            target_ci=parsed_args.target_ci,
+            input_mode=parsed_args.input_mode,
+            graph_cache=parsed_args.graph_cache,
+            frozen=parsed_args.frozen,
+            engine=parsed_args.engine,
+        )
+        if parsed_args.json:
+            print(json.dumps(tuned, indent=4, default=json_default))
+        return
+
+    if parsed_args.mode == 'worker':
+        if parsed_args.coordinator is None:
+            parser.error("worker requires --coordinator")
+        benchmark.work(
+            parsed_args.coordinator, host=parsed_args.worker_name, data_store=parsed_args.data_store,
+            graph_cache=parsed_args.graph_cache, profile=parsed_args.profile,
+            journal=parsed_args.journal or (journal_utils.DEFAULT_JOURNAL if parsed_args.resume else None),
+            resume=parsed_args.resume)
+        return
+
+    # Sweeps, load tests and batching simulations only run the inference subtests
+    training = parsed_args.run_training and parsed_args.mode not in ('sweep', 'load', 'batching')
+    if parsed_args.frozen and training:
+        parser.error("--frozen requires an inference-only run (-T 0)")
+    if parsed_args.engine == 'function' and training:
+        parser.error("--engine function requires an inference-only run (-T 0)")
+
+    if (parsed_args.memory_limit is not None or parsed_args.test_timeout is not None) and not parsed_args.isolate:
+        parser.error("--memory-limit and --test-timeout require --isolate")
+    if parsed_args.isolate and parsed_args.workers > 1:
+        parser.error("--isolate cannot be combined with --workers")
+    if parsed_args.iteration_timeout and (parsed_args.streams > 1 or parsed_args.mode in ('load', 'batching')):
+        parser.error("--iteration-timeout only applies to single-stream runs, not to --streams, load or batching")
+
+    run_args = dict(
         precision=parsed_args.precision,
         test_ids=parsed_args.test_ids,
         training=parsed_args.run_training,
@@ -82,7 +342,75 @@ def main():
         cpu_cores=parsed_args.cpu_cores,
         inter_threads=parsed_args.inter_threads,
         intra_threads=parsed_args.intra_threads,
+        cache_size=parsed_args.cache_size,
+        data_store=parsed_args.data_store,
+        prefetch=parsed_args.prefetch,
+        synthetic=parsed_args.synthetic,
+        outlier_rejection=parsed_args.reject_outliers,
+        detect_warmup=parsed_args.detect_warmup,
+        adaptive=parsed_args.adaptive,
+        target_ci=parsed_args.target_ci,
+        time_budget=parsed_args.time_budget,
+        input_mode=parsed_args.input_mode,
+        graph_cache=parsed_args.graph_cache,
+        frozen=parsed_args.frozen,
+        engine=parsed_args.engine,
+        streams=parsed_args.streams,
+        workers=parsed_args.workers,
+        isolate=parsed_args.isolate,
+        memory_limit=parsed_args.memory_limit,
+        test_timeout=parsed_args.test_timeout,
+        iteration_timeout=parsed_args.iteration_timeout,
+        journal=parsed_args.journal or (journal_utils.DEFAULT_JOURNAL if parsed_args.resume else None),
+        resume=parsed_args.resume,
+        profile=parsed_args.profile,
+        profile_objective=parsed_args.profile_objective,
     )
+    grappler = dict(parsed_args.grappler) if parsed_args.grappler else None
+
+    if parsed_args.mode == 'compare':
+        comparison = benchmark.compare(xla=parsed_args.xla or grappler is None, grappler=grappler, **run_args)
+        if parsed_args.json:
+            print(json.dumps(comparison, indent=4, default=json_default))
+        return
+
+    if parsed_args.mode == 'coordinator':
+        run_args.pop('test_ids')
+        cluster_results = benchmark.coordinate(
+            test_ids=parsed_args.test_ids, agents=parsed_args.agents, distribute=parsed_args.distribute,
+            host=parsed_args.host, port=parsed_args.port, timeout=parsed_args.cluster_timeout,
+            xla=parsed_args.xla, grappler=grappler, **run_args)
+        if parsed_args.json:
+            print(json.dumps(cluster_results, indent=4, default=json_default))
+        return
+
+    if parsed_args.mode == 'sweep':
+        sweeps = benchmark.sweep(batch_sizes=parsed_args.batch_sizes, xla=parsed_args.xla, grappler=grappler, **run_args)
+        if parsed_args.json:
+            print(json.dumps(sweeps, indent=4, default=json_default))
+        return
+
+    if parsed_args.mode == 'load':
+        load_curves = benchmark.load(qps=parsed_args.qps,
+                                     duration=parsed_args.load_duration or serving_utils.DEFAULT_LOAD_DURATION,
+                                     xla=parsed_args.xla, grappler=grappler, **run_args)
+        if parsed_args.json:
+            print(json.dumps(load_curves, indent=4, default=json_default))
+        return
+
+    if parsed_args.mode == 'batching':
+        if parsed_args.qps is not None and len(parsed_args.qps) > 1:
+            parser.error("batching takes a single --qps rate")
+        batching = benchmark.simulate_batching(
+            qps=parsed_args.qps[0] if parsed_args.qps else None, max_batches=parsed_args.max_batch,
+            timeouts=parsed_args.batch_timeout,
+            duration=parsed_args.load_duration or serving_utils.DEFAULT_BATCHING_DURATION,
+            xla=parsed_args.xla, grappler=grappler, **run_args)
+        if parsed_args.json:
+            print(json.dumps(batching, indent=4, default=json_default))
+        return
+
+    test_info, results, _ = benchmark.run(xla=parsed_args.xla, grappler=grappler, **run_args)
     if parsed_args.json:
         output = vars(results)
         output['test_results'] = {
@@ -91,7 +419,7 @@ def main():
         }
         output['test_info'] = vars(test_info)
         output['test_info'].pop('results', None)
-        print(json.dumps(output, indent=4))
+        print(json.dumps(output, indent=4, default=json_default))
 
 
 if __name__ == '__main__':
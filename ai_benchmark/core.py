@@ -1,9 +1,15 @@
 import os
+import functools
 import logging
 import numpy as np
 import pandas as pd
 import tensorflow as tf
 from ai_benchmark import utils
+from ai_benchmark import tune_utils
+from ai_benchmark import graph_utils
+from ai_benchmark import serving_utils
+from ai_benchmark import process_utils
+from ai_benchmark import cluster_utils
 
 logger = logging.getLogger('ai_benchmark')
 
@@ -43,6 +49,7 @@ class AIBenchmark:
             logger.warning("%s", err)
 
         np.random.seed(seed)
+        self.seed = seed
         self.cwd = os.path.dirname(__file__)
 
         self.use_cpu = False
@@ -50,8 +57,32 @@ class AIBenchmark:
             self.use_cpu = True
 
     def run(self, precision="normal", test_ids=None, training=True, inference=True, micro=False,
-            cpu_cores=None, inter_threads=None, intra_threads=None):
-        return utils.run_tests(
+            cpu_cores=None, inter_threads=None, intra_threads=None, cache_size=None,
+            data_store=None, prefetch=0, synthetic=False, outlier_rejection=False, detect_warmup=False,
+            adaptive=False, target_ci=utils.DEFAULT_TARGET_CI, time_budget=None, input_mode="feed",
+            graph_cache=None, profile=None, profile_objective="throughput", xla=False, grappler=None,
+            frozen=False, engine="session", batch_sweep=False, batch_sizes=None,
+            streams=1, load_test=False, load_qps=None, load_duration=serving_utils.DEFAULT_LOAD_DURATION,
+            batching=False, batching_qps=None, max_batches=None, batch_timeouts=None, workers=1, cpus=None,
+            isolate=False, memory_limit=None, test_timeout=None, iteration_timeout=None, journal=None, resume=False,
+            report=True):
+
+        # The thread profile is either a file written by tune or a mapping of test ids to thread settings
+        if isinstance(profile, str):
+            profile = tune_utils.load_profile(profile, profile_objective, utils.get_environment())
+
+        # Parallel runs split the tests between processes pinned to disjoint CPU sets,
+        # isolated runs start a new process for every test
+        if workers > 1 and isolate:
+            raise ValueError("Parallel and isolated runs cannot be combined")
+        if workers > 1:
+            run_tests = functools.partial(process_utils.run_parallel, workers, cpus=cpus)
+        elif isolate:
+            run_tests = functools.partial(process_utils.run_isolated, memory_limit=memory_limit, timeout=test_timeout)
+        else:
+            run_tests = utils.run_tests
+
+        return run_tests(
             training=training,
             inference=inference,
             micro=micro,
@@ -64,8 +95,117 @@ class AIBenchmark:
             cpu_cores=cpu_cores,
             inter_threads=inter_threads,
             intra_threads=intra_threads,
+            cache_size=cache_size,
+            data_store=data_store,
+            prefetch=prefetch,
+            synthetic=synthetic,
+            seed=self.seed,
+            outlier_rejection=outlier_rejection,
+            detect_warmup=detect_warmup,
+            adaptive=adaptive,
+            target_ci=target_ci,
+            time_budget=time_budget,
+            input_mode=input_mode,
+            graph_cache=graph_cache,
+            thread_profile=profile,
+            xla=xla,
+            grappler=grappler,
+            frozen=frozen,
+            engine=engine,
+            batch_sweep=batch_sweep,
+            batch_sizes=batch_sizes,
+            streams=streams,
+            load_test=load_test,
+            load_qps=load_qps,
+            load_duration=load_duration,
+            batching=batching,
+            batching_qps=batching_qps,
+            max_batches=max_batches,
+            batch_timeouts=batch_timeouts,
+            iteration_timeout=iteration_timeout,
+            journal=journal,
+            resume=resume,
+            report=report,
         )
 
+    def compare(self, xla=True, grappler=None, **kwargs):
+
+        # Same tests and settings, with the default graph optimizations and then with the selected ones
+        if xla:
+            graph_utils.enable_xla_cpu_jit()
+        # Mode runs are not uploaded, their scores are not those of a regular run
+        _, baseline, _ = self.run(report=False, **kwargs)
+        _, optimized, _ = self.run(xla=xla, grappler=grappler, report=False, **kwargs)
+
+        comparison = utils.compare_results(baseline, optimized)
+        utils.print_comparison(comparison)
+        return comparison
+
+    def sweep(self, batch_sizes=None, test_ids=None, **kwargs):
+
+        kwargs.update(training=False, inference=True, micro=False, report=False)
+        _, public_results, _ = self.run(test_ids=test_ids, batch_sweep=True, batch_sizes=batch_sizes, **kwargs)
+
+        sweep_tests = [serving_utils.get_sweep_test(test, batch_sizes)
+                       for test in utils.TestConstructor().get_tests(test_ids)]
+        sweeps = serving_utils.get_sweep_results(sweep_tests, public_results)
+        serving_utils.print_sweep_results(sweeps)
+        return sweeps
+
+    def load(self, qps=None, duration=serving_utils.DEFAULT_LOAD_DURATION, test_ids=None, **kwargs):
+
+        kwargs.update(training=False, inference=True, micro=False, report=False)
+        _, public_results, _ = self.run(test_ids=test_ids, load_test=True, load_qps=qps, load_duration=duration,
+                                        **kwargs)
+        return dict((public_id, result.load) for public_id, result in public_results.test_results.items()
+                    if result.load is not None)
+
+    def simulate_batching(self, qps=None, max_batches=None, timeouts=None,
+                          duration=serving_utils.DEFAULT_BATCHING_DURATION, test_ids=None, **kwargs):
+
+        kwargs.update(training=False, inference=True, micro=False, report=False)
+        _, public_results, _ = self.run(test_ids=test_ids, batching=True, batching_qps=qps, max_batches=max_batches,
+                                        batch_timeouts=timeouts, load_duration=duration, **kwargs)
+        return dict((public_id, result.batching) for public_id, result in public_results.test_results.items()
+                    if result.batching is not None)
+
+    def coordinate(self, test_ids=None, agents=1, distribute=False, host="0.0.0.0", port=cluster_utils.DEFAULT_PORT,
+                   timeout=None, **kwargs):
+
+        # The remaining arguments are the run settings sent to the workers with every job
+        test_ids = [str(test.id) for test in utils.TestConstructor().get_tests(test_ids)]
+        coordinator = cluster_utils.Coordinator(test_ids, kwargs, agents, distribute)
+        results = coordinator.serve(host, port, timeout)
+        cluster_utils.print_cluster_results(results)
+        return results
+
+    def work(self, coordinator, host=None, connect_timeout=cluster_utils.CONNECT_TIMEOUT, **local_settings):
+
+        # The local settings, e.g. the data store of this host, complete the run settings sent with the jobs
+        environment = utils.get_environment()
+
+        def run_job(job):
+            test_info, public_results, _ = self.run(test_ids=[job["test_id"]], report=False,
+                                                    **dict(job["config"], **local_settings))
+            return cluster_utils.get_job_result(job, test_info, public_results, environment)
+
+        return cluster_utils.run_worker(coordinator, run_job, environment, host, connect_timeout)
+
+    def tune(self, profile=tune_utils.DEFAULT_PROFILE, test_ids=None, cpu_cores=None, core_counts=None,
+             inter_threads=None, intra_threads=None, time_budget=tune_utils.DEFAULT_TUNE_BUDGET, **kwargs):
+
+        candidates = tune_utils.get_candidates(cpu_cores or utils.get_num_cpu_cores(), core_counts,
+                                               inter_threads, intra_threads)
+        tuned = tune_utils.tune_threads(self.run, candidates, test_ids, time_budget, report=False, **kwargs)
+
+        tune_utils.print_tuned_profile(tuned)
+        if profile is not None:
+            tune_utils.save_profile(profile, tuned, utils.get_environment())
+        return tuned
+
+    def prepare_data_store(self, data_store, test_ids=None):
+        utils.prepare_data_store(utils.DatasetStore(data_store), test_ids=test_ids)
+
 
 
 
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019-2020 by Andrey Ignatov. All Rights Reserved.
+
+import os
+import sys
+import queue
+import hashlib
+import logging
+import threading
+from os import path
+from collections import OrderedDict
+
+import numpy as np
+import PIL
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+from ai_benchmark.io_utils import write_atomic
+
+DEFAULT_CACHE_SIZE_MB = 1024
+DATA_DIR = path.join(path.dirname(__file__), "data")
+# Bump when the preprocessing changes, so that stale data stores are not reused
+DATA_STORE_VERSION = 2
+IMAGE_TEST_TYPES = ("classification", "enhancement", "segmentation")
+NLP_TEXT = "This is a story of how a Baggins had an adventure, " \
+           "and found himself doing and saying things altogether unexpected."
+# Test types whose targets are made from the same images as the inputs
+SHARED_TARGET_TYPES = ("enhancement",)
+
+# Only deterministic, image-based batches are persisted: random nlp inputs
+# and one-hot targets are cheap to generate and depend on the seed
+STORED_DATA = {
+    "data": IMAGE_TEST_TYPES,
+    "targets": ("segmentation",),
+}
+
+logger = logging.getLogger('ai_benchmark')
+
+# Fingerprints of the data directories, by the size and modification time of their files
+_FINGERPRINTS = {}
+
+
+def get_nbytes(value):
+    # Memory-mapped batches live in the shared page cache, not in private memory
+    if isinstance(value, np.memmap):
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+class DataCache:
+    """In-memory LRU cache for preprocessed inputs and targets
+
+    Pinned entries, e.g. the synthetic batches that must be generated once per shape and test, are kept
+    outside of the size limit and never evicted, until clear_pinned.
+    """
+    def __init__(self, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+        self.max_bytes = int(max_size_mb * 1024 ** 2)
+        self.size = 0
+        self.pinned_size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pinned = {}
+
+    def __len__(self):
+        return len(self._entries) + len(self._pinned)
+
+    def __contains__(self, key):
+        return key in self._entries or key in self._pinned
+
+    def get(self, key, loader, pinned=False):
+        if key in self._pinned:
+            self.hits += 1
+            return self._pinned[key]
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+        self.misses += 1
+        value = loader()
+        self.put(key, value, pinned)
+        return value
+
+    def put(self, key, value, pinned=False):
+        nbytes = get_nbytes(value)
+        self.pop(key)
+
+        if nbytes > self.max_bytes and not pinned:
+            logger.debug("Data cache: %s (%d bytes) exceeds the cache size", key, nbytes)
+            return
+
+        # Cached batches are shared between iterations and must not be modified in-place
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+
+        if pinned:
+            self._pinned[key] = value
+            self.pinned_size += nbytes
+            return
+
+        while self._entries and self.size + nbytes > self.max_bytes:
+            evicted_key, evicted_value = self._entries.popitem(last=False)
+            self.size -= get_nbytes(evicted_value)
+            logger.debug("Data cache: evicted %s", evicted_key)
+
+        self._entries[key] = value
+        self.size += nbytes
+
+    def clear_pinned(self):
+        self._pinned.clear()
+        self.pinned_size = 0
+
+    def pop(self, key):
+        if key in self._pinned:
+            value = self._pinned.pop(key)
+            self.pinned_size -= get_nbytes(value)
+            return value
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self.size -= get_nbytes(value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+
+def resize_image(image, dimensions):
+
+    image = np.asarray(image)
+
+    height = image.shape[0]
+    width = image.shape[1]
+
+    aspect_ratio_image = float(width) / height
+    aspect_ratio_target = float(dimensions[1]) / dimensions[0]
+
+    if aspect_ratio_target == aspect_ratio_image:
+        image = Image.fromarray(image).resize((dimensions[1], dimensions[0]))
+
+    elif aspect_ratio_image < aspect_ratio_target:
+        new_height = int(float(width) / aspect_ratio_target)
+        offset = int((height - new_height) / 2)
+        image = image[offset:offset + new_height, :, :]
+        image = Image.fromarray(image).resize((dimensions[1], dimensions[0]))
+
+    else:
+        new_width = int(float(height) * aspect_ratio_target)
+        offset = int((width - new_width) / 2)
+        image = image[:, offset:offset + new_width, :]
+        image = Image.fromarray(image).resize((dimensions[1], dimensions[0]))
+
+    return image
+
+
+def get_image_count(test_type):
+    # Images are numbered from 0, segmentation masks share the number of their image
+    return len([name for name in os.listdir(path.join(DATA_DIR, test_type)) if path.splitext(name)[0].isdigit()])
+
+
+def get_image_paths(test_type, batch_size, suffix=""):
+    # Batches larger than the bundled set reuse its images in order
+    count = get_image_count(test_type)
+    return [path.join(DATA_DIR, test_type, str(j % count) + suffix + ".jpg") for j in range(batch_size)]
+
+
+def load_images(file_path, sizes):
+
+    image = Image.open(file_path)
+
+    # Let the JPEG decoder downscale by a power of two as long as the center
+    # crop taken by resize_image still covers the largest target size
+    width, height = image.size
+    scale = 0
+    for size in sizes:
+        crop_width = min(width, height * float(size[1]) / size[0])
+        crop_height = min(height, width * float(size[0]) / size[1])
+        scale = max(scale, size[1] / crop_width, size[0] / crop_height)
+
+    if scale < 1:
+        image.draft("RGB", (int(np.ceil(width * scale)), int(np.ceil(height * scale))))
+
+    image = np.asarray(image)
+    return [resize_image(image, size) for size in sizes]
+
+
+def load_image(file_path, dimensions):
+    return load_images(file_path, [dimensions])[0]
+
+
+def load_image_batches(file_paths, dimensions_list, dtype=np.float32, workers=None):
+
+    batches = [np.empty([len(file_paths)] + list(dimensions[1:]), dtype=dtype) for dimensions in dimensions_list]
+    sizes = [dimensions[1:3] for dimensions in dimensions_list]
+
+    def load(j):
+        for data, image in zip(batches, load_images(file_paths[j], sizes)):
+            data[j] = image
+
+    # PIL releases the GIL while decoding and resampling, so threads are enough
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(load, range(len(file_paths))))
+
+    return batches
+
+
+def load_image_batch(file_paths, dimensions, dtype=np.float32, workers=None):
+    return load_image_batches(file_paths, [dimensions], dtype, workers)[0]
+
+
+def generate_data(rng, test_type, dimensions, dtype=np.float32):
+
+    # Random values are drawn directly in float32 and scaled to the range of the real data
+    if test_type in IMAGE_TEST_TYPES:
+        return (rng.random(dimensions, dtype=np.float32) * np.float32(255)).astype(dtype, copy=False)
+
+    if test_type == "nlp":
+        return (rng.random(dimensions, dtype=np.float32) * np.float32(8) - np.float32(4)).astype(dtype, copy=False)
+
+    if test_type == "nlp-text":
+        return NLP_TEXT
+
+    return None
+
+
+def generate_targets(rng, test_type, dimensions, dtype=np.float32):
+
+    if test_type == "classification" or test_type == "nlp":
+        data = np.zeros(dimensions, dtype=dtype)
+        data[np.arange(dimensions[0]), rng.integers(dimensions[1], size=dimensions[0])] = 1
+        return data
+
+    return generate_data(rng, test_type, dimensions, dtype)
+
+
+def get_data_fingerprint(data_dir=DATA_DIR):
+
+    files = []
+    for root, dirs, names in sorted(os.walk(data_dir)):
+        for name in sorted(names):
+            file_path = path.join(root, name)
+            stat = os.stat(file_path)
+            files.append((path.relpath(file_path, data_dir), stat.st_size, stat.st_mtime_ns))
+
+    # The contents are hashed once per process, and again only if a file is added, changed or touched
+    key = (data_dir, tuple(files))
+    if key not in _FINGERPRINTS:
+        # Resized images depend on the source files and on the PIL resampling code
+        digest = hashlib.sha1(("%s-%s" % (DATA_STORE_VERSION, PIL.__version__)).encode())
+        for relpath, size, mtime in files:
+            digest.update(relpath.encode())
+            with open(path.join(data_dir, relpath), "rb") as f:
+                digest.update(f.read())
+        _FINGERPRINTS[key] = digest.hexdigest()[:16]
+    return _FINGERPRINTS[key]
+
+
+class DatasetStore:
+    """On-disk store of preprocessed batches opened as read-only memory maps"""
+    def __init__(self, root):
+        # Resolved before run_tests changes the working directory
+        self.root = path.join(path.abspath(path.expanduser(root)), get_data_fingerprint())
+
+    def is_stored(self, kind, test_type):
+        return test_type in STORED_DATA.get(kind, ())
+
+    def get_path(self, kind, test_type, dimensions, dtype):
+        # One file per image size: smaller batches are served as slices of it
+        name = "%s-%s-%s-%s.npy" % (kind, test_type, "x".join(str(d) for d in dimensions[1:]), np.dtype(dtype).name)
+        return path.join(self.root, name)
+
+    def load(self, kind, test_type, dimensions, dtype, loader):
+        if not self.is_stored(kind, test_type):
+            return loader()
+
+        file_path = self.get_path(kind, test_type, dimensions, dtype)
+        batch_size = dimensions[0]
+
+        if path.exists(file_path):
+            try:
+                data = np.load(file_path, mmap_mode='r')
+                if data.shape[0] >= batch_size:
+                    return data[:batch_size]
+            except (IOError, ValueError) as err:
+                logger.warning("Data store: cannot read %s: %s", file_path, err)
+
+        self.save(file_path, loader())
+        return np.load(file_path, mmap_mode='r')[:batch_size]
+
+    def save(self, file_path, data):
+        if not path.isdir(self.root):
+            os.makedirs(self.root, exist_ok=True)
+
+        # Concurrent runs may fill the store at the same time
+        write_atomic(file_path, lambda f: np.save(f, np.ascontiguousarray(data)))
+        logger.debug("Data store: saved %s", file_path)
+
+
+class Prefetcher:
+    """Prepares the next batches in a background thread while the current one is processed"""
+    def __init__(self, loader, depth=2):
+        self.loader = loader
+        self.depth = depth
+        self._queue = queue.Queue(maxsize=max(depth, 1))
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _produce(self):
+        while not self._stopped.is_set():
+            try:
+                item = (self.loader(), None)
+            except Exception as err:
+                item = (None, err)
+
+            while not self._stopped.is_set():
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+            if item[1] is not None:
+                return
+
+    def get(self):
+        if self.depth <= 0:
+            return self.loader()
+
+        # The producer is started lazily, so that skipped subtests do not load any data
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._produce, name="ai-benchmark-prefetch", daemon=True)
+            self._thread.start()
+
+        item, err = self._queue.get()
+        if err is not None:
+            raise err
+        return item
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        while not self._queue.empty():
+            self._queue.get_nowait()
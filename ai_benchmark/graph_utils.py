@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019-2020 by Andrey Ignatov. All Rights Reserved.
+
+import os
+import hashlib
+import logging
+from os import path
+
+import tensorflow as tf
+from tensorflow.python.framework import meta_graph
+from tensorflow.python.eager import context
+from tensorflow.core.protobuf import rewriter_config_pb2
+
+from ai_benchmark.io_utils import write_atomic
+
+INPUT_MODES = ("feed", "graph")
+ENGINES = ("session", "function")
+# Grappler rewriters that can be switched per run, by the RewriterConfig field they map to
+GRAPPLER_OPTIMIZERS = {
+    "layout": "layout_optimizer",
+    "remapping": "remapping",
+    "constant_folding": "constant_folding",
+    "arithmetic": "arithmetic_optimization",
+}
+GRAPPLER_TOGGLES = ("default", "on", "off", "aggressive")
+# Suffix of the cache files recording that a graph could not be produced, e.g. frozen
+UNAVAILABLE_SUFFIX = ".unavailable"
+
+logger = logging.getLogger('ai_benchmark')
+
+# Parsed meta graphs and frozen graphs shared by all the runs of this process
+_META_GRAPHS = {}
+
+
+def read_meta_graph(model_src):
+    return meta_graph.read_meta_graph_file(model_src)
+
+
+def get_file_digest(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def clear_devices(meta_graph_def):
+    for node in meta_graph_def.graph_def.node:
+        node.device = ""
+    for function in meta_graph_def.graph_def.library.function:
+        for node in function.node_def:
+            node.device = ""
+    return meta_graph_def
+
+
+def freeze_graph(meta_graph_def, output_names=("output",)):
+
+    # Variables are frozen with their initial values, as in the regular runs
+    with tf.Graph().as_default() as graph:
+        tf.compat.v1.train.import_meta_graph(meta_graph_def)
+        config = tf.compat.v1.ConfigProto(device_count={'GPU': 0})
+        with tf.compat.v1.Session(graph=graph, config=config) as sess:
+            sess.run(tf.compat.v1.global_variables_initializer())
+            # Also prunes the graph to the nodes the outputs depend on, dropping the saver and training ops
+            graph_def = tf.compat.v1.graph_util.convert_variables_to_constants(
+                sess, graph.as_graph_def(), list(output_names))
+
+    # Graphs updating their variables during inference (e.g. the power iteration of spectral normalization) cannot be frozen
+    if any(node.op.startswith("Assign") for node in graph_def.node):
+        return None
+
+    return tf.compat.v1.graph_util.remove_training_nodes(graph_def, protected_nodes=["input"] + list(output_names))
+
+
+class MetaGraphCache:
+    """Process-level and optional on-disk cache of parsed meta graphs and of their frozen inference graphs
+
+    The Grappler-optimized graphs are not cached: Grappler rewrites the graph in every session with the
+    rewriter config of the run (--grappler, --xla), and its output drops the variables and savers that
+    training needs.
+    """
+    def __init__(self, cache_dir=None):
+        # Resolved before run_tests changes the working directory
+        self.cache_dir = path.abspath(path.expanduser(cache_dir)) if cache_dir else None
+
+    def get_cache_path(self, model_src, suffix="meta"):
+        # Serialized graphs depend on both the source file and the TF version that wrote them
+        name = "%s-tf%s.%s" % (get_file_digest(model_src), tf.__version__, suffix)
+        return path.join(self.cache_dir, name)
+
+    def load(self, model_src):
+        return self.get(model_src, "meta", tf.compat.v1.MetaGraphDef,
+                        lambda: clear_devices(read_meta_graph(model_src)))
+
+    def load_frozen(self, model_src):
+        return self.get(model_src, "frozen.pb", tf.compat.v1.GraphDef,
+                        lambda: freeze_graph(self.load(model_src)))
+
+    def get(self, model_src, suffix, proto, loader):
+        stat = os.stat(model_src)
+        key = (path.abspath(model_src), stat.st_size, stat.st_mtime_ns, tf.__version__, suffix)
+        if key in _META_GRAPHS:
+            return _META_GRAPHS[key]
+
+        graph_def = None
+        cache_path = self.get_cache_path(model_src, suffix) if self.cache_dir else None
+
+        # Marks the graphs the loader could not produce, e.g. the ones that cannot be frozen
+        if cache_path is not None and path.exists(cache_path + UNAVAILABLE_SUFFIX):
+            _META_GRAPHS[key] = None
+            return None
+
+        if cache_path is not None and path.exists(cache_path):
+            try:
+                graph_def = proto()
+                with open(cache_path, "rb") as f:
+                    graph_def.ParseFromString(f.read())
+            except Exception as err:
+                logger.warning("Graph cache: cannot read %s: %s", cache_path, err)
+                graph_def = None
+
+        if graph_def is None:
+            graph_def = loader()
+            if cache_path is not None:
+                self.save(cache_path, graph_def)
+
+        _META_GRAPHS[key] = graph_def
+        return graph_def
+
+    def save(self, cache_path, graph_def):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if graph_def is None:
+            cache_path += UNAVAILABLE_SUFFIX
+        write_atomic(cache_path, lambda f: f.write(graph_def.SerializeToString() if graph_def is not None else b""))
+        logger.debug("Graph cache: saved %s", cache_path)
+
+
+def enable_xla_cpu_jit():
+    # On CPU, auto-clustering ignores global_jit_level unless this flag is set,
+    # and TensorFlow parses the flags once, when the first session is created
+    flags = os.environ.get("TF_XLA_FLAGS", "")
+    if "--tf_xla_cpu_global_jit" not in flags:
+        os.environ["TF_XLA_FLAGS"] = (flags + " --tf_xla_cpu_global_jit").strip()
+
+
+def set_graph_options(config, xla=False, grappler=None):
+
+    if xla:
+        enable_xla_cpu_jit()
+        config.graph_options.optimizer_options.global_jit_level = tf.compat.v1.OptimizerOptions.ON_1
+
+    rewrite_options = config.graph_options.rewrite_options
+    for name, toggle in (grappler or {}).items():
+        if name not in GRAPPLER_OPTIMIZERS or toggle not in GRAPPLER_TOGGLES:
+            raise ValueError("Unknown Grappler option: %s=%s" % (name, toggle))
+        setattr(rewrite_options, GRAPPLER_OPTIMIZERS[name], getattr(rewriter_config_pb2.RewriterConfig, toggle.upper()))
+
+    return config
+
+
+def set_function_options(inter_threads=None, intra_threads=None, xla=False, grappler=None):
+    """Applies the session settings to the eager runtime calling the concrete functions"""
+
+    # The eager thread pools are shared by the process and sized once, before the first eager op
+    for name, threads in (("inter_op", inter_threads), ("intra_op", intra_threads)):
+        if not threads or getattr(tf.config.threading, "get_%s_parallelism_threads" % name)() == threads:
+            continue
+        try:
+            getattr(tf.config.threading, "set_%s_parallelism_threads" % name)(threads)
+        except RuntimeError:
+            raise ValueError("The function engine cannot switch to %d %s threads once TensorFlow has started, "
+                             "run it in a new process" % (threads, name.replace("_", "-")))
+
+    if xla:
+        enable_xla_cpu_jit()
+    tf.config.optimizer.set_jit(bool(xla))
+
+    # None keeps the default of an optimizer, e.g. the one toggled by the previous run of this process
+    options = dict((option, None) for option in GRAPPLER_OPTIMIZERS.values())
+    for name, toggle in (grappler or {}).items():
+        if name not in GRAPPLER_OPTIMIZERS or toggle not in GRAPPLER_TOGGLES:
+            raise ValueError("Unknown Grappler option: %s=%s" % (name, toggle))
+        if toggle == "aggressive":
+            raise ValueError("The function engine only supports the on, off and default Grappler toggles")
+        options[GRAPPLER_OPTIMIZERS[name]] = {"on": True, "off": False}.get(toggle)
+    tf.config.optimizer.set_experimental_options(options)
+
+
+def get_placeholder_signature(graph_def, name="input"):
+    for node in graph_def.node:
+        if node.name == name and node.op == "Placeholder":
+            shape = tf.TensorShape(node.attr["shape"].shape) if "shape" in node.attr else tf.TensorShape(None)
+            return tf.as_dtype(node.attr["dtype"].type), shape
+    return None, None
+
+
+class StagedInput:
+    """Graph variable holding a preprocessed batch, staged once instead of fed on every iteration"""
+    def __init__(self, dtype, shape, name="staged_input"):
+        # The batch dimension is left open, so that the variable can start empty
+        shape = tf.TensorShape(shape)
+        if shape.rank:
+            shape = tf.TensorShape([None]).concatenate(shape[1:])
+        initial_shape = [0 if dim is None else dim for dim in shape.as_list()] if shape.rank is not None else []
+
+        with tf.compat.v1.name_scope(name):
+            self.variable = tf.compat.v1.Variable(
+                tf.zeros(initial_shape, dtype), shape=shape, trainable=False, use_resource=True, name="variable")
+            self.placeholder = tf.compat.v1.placeholder(dtype, shape, name="placeholder")
+            self.stage_op = self.variable.assign(self.placeholder, read_value=False)
+            self.value = self.variable.read_value()
+
+    def stage(self, sess, data):
+        sess.run(self.stage_op, feed_dict={self.placeholder: data})
+
+
+def create_staged_input(dtype, shape, name="staged_input"):
+    # String inputs (GNMT) are tiny and go through the lookup tables, so they are always fed
+    if dtype is None or dtype == tf.string:
+        return None
+    return StagedInput(dtype, shape, name)
+
+
+def create_input(dtype, shape, input_mode="feed", name=None, staged_name="staged_input"):
+    if input_mode == "graph":
+        staged_input = create_staged_input(dtype, shape, staged_name)
+        if staged_input is not None:
+            return staged_input
+    return tf.compat.v1.placeholder(dtype, shape, name=name)
+
+
+def get_tensor(input_):
+    return input_.value if isinstance(input_, StagedInput) else input_
+
+
+def is_staged(inputs):
+    return all(isinstance(input_, StagedInput) for input_ in inputs)
+
+
+def next_feed_dict(sess, inputs, batches, feed_dict=None):
+
+    # Staged inputs are filled with the first batch only, the others are fed on every iteration
+    first = feed_dict is None
+    if not first and is_staged(inputs):
+        return feed_dict
+
+    feed_dict = {}
+    for input_, data in zip(inputs, batches.get()):
+        if not isinstance(input_, StagedInput):
+            feed_dict[input_] = data
+        elif first:
+            input_.stage(sess, data)
+    return feed_dict
+
+
+def wrap_frozen_graph(graph_def, input_name="input:0", output_name="output:0", device=None):
+
+    # The device, e.g. /CPU:0 for CPU inference, is set on the imported ops as sessions place them with device_count
+    def import_graph_def():
+        with tf.device(device):
+            tf.compat.v1.import_graph_def(graph_def, name="")
+
+    # Concrete functions are built and called eagerly, outside of the graph of the test session
+    with context.eager_mode():
+        wrapped = tf.compat.v1.wrap_function(import_graph_def, [])
+        graph = wrapped.graph
+        return wrapped.prune(graph.as_graph_element(input_name), graph.as_graph_element(output_name))
+
+
+class FunctionCall:
+    """Calls a concrete function with eager tensors made from the prefetched batches"""
+    def __init__(self, function, input_mode="feed"):
+        self.function = function
+        self.staged = input_mode == "graph"
+        self.batch = None
+        self.inputs = None
+
+    def next_batch(self, batches):
+        # As with staged inputs, graph mode converts the first batch only. Otherwise the
+        # conversion is timed with the call, like the feed is timed with Session.run
+        if self.staged and self.inputs is not None:
+            return
+        self.set_batch(batches.get())
+
+    def set_batch(self, batch):
+        self.batch = batch
+        if self.staged:
+            with context.eager_mode():
+                self.inputs = [tf.convert_to_tensor(data) for data in self.batch]
+
+    def __call__(self):
+        if not self.staged:
+            return self.run(self.batch)
+        with context.eager_mode():
+            return self.function(*self.inputs).numpy()
+
+    def run(self, batch):
+        with context.eager_mode():
+            return self.function(*[tf.convert_to_tensor(data) for data in batch]).numpy()
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019-2020 by Andrey Ignatov. All Rights Reserved.
+
+import os
+
+import numpy as np
+
+
+def json_default(obj):
+    """Serialize numpy values, e.g. the raw per-iteration samples"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+def write_atomic(file_path, write, mode="wb"):
+    # Concurrent runs may write the same file, so each process writes its own
+    # temporary file and atomically moves it into place
+    tmp_path = "%s.%d.tmp" % (file_path, os.getpid())
+    with open(tmp_path, mode) as f:
+        write(f)
+    os.replace(tmp_path, file_path)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019-2020 by Andrey Ignatov. All Rights Reserved.
+
+import os
+import json
+import hashlib
+import logging
+from os import path
+
+from ai_benchmark.io_utils import json_default
+
+JOURNAL_VERSION = 1
+DEFAULT_JOURNAL = "ai_benchmark_journal.jsonl"
+
+logger = logging.getLogger('ai_benchmark')
+
+
+def get_fingerprint(environment, config):
+    # Results are only reused on the same system, with the same settings
+    data = json.dumps({"environment": environment, "config": config}, sort_keys=True, default=json_default)
+    return hashlib.sha1(data.encode()).hexdigest()[:16]
+
+
+class Journal:
+    """Append-only file of the finished subtests and tests, one JSON record per line"""
+    def __init__(self, file_path, environment, config):
+        # Resolved before run_tests changes the working directory
+        self.file_path = path.abspath(path.expanduser(file_path))
+        self.config = config
+        self.fingerprint = get_fingerprint(environment, config)
+
+    def append(self, record):
+        record = dict(record, version=JOURNAL_VERSION, fingerprint=self.fingerprint)
+        line = json.dumps(record, default=json_default) + "\n"
+        # A run killed while writing leaves a partial last line, the next record starts on a line of its own
+        if not self.ends_with_newline():
+            line = "\n" + line
+        # Every record is on disk before the next test starts
+        with open(self.file_path, "a") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def ends_with_newline(self):
+        if not path.exists(self.file_path) or path.getsize(self.file_path) == 0:
+            return True
+        with open(self.file_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def start_test(self, test_id):
+        self.append({"type": "start", "test_id": str(test_id)})
+
+    def add_subtest(self, test_id, public_id, kind, result, norm):
+        self.append({"type": "subtest", "test_id": str(test_id), "public_id": public_id, "kind": kind,
+                     "result": vars(result), "norm": norm, "config": self.config})
+
+    def add_test(self, test_id, phase_times):
+        self.append({"type": "test", "test_id": str(test_id), "phase_times": phase_times})
+
+    def read(self):
+        if not path.exists(self.file_path):
+            return []
+        records = []
+        with open(self.file_path) as f:
+            for i, line in enumerate(f, 1):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # The last line is cut short if the run was killed while writing it
+                    logger.warning("Journal %s: skipping unreadable line %d", self.file_path, i)
+        return records
+
+    def load(self):
+
+        # Finished tests with their subtests, the other records are from interrupted tests or other systems
+        subtests = {}
+        finished = {}
+        for record in self.read():
+            if record.get("version") != JOURNAL_VERSION or record.get("fingerprint") != self.fingerprint:
+                continue
+            if record["type"] == "start":
+                # The subtests of an interrupted attempt are not mixed with the ones of the next attempt
+                subtests.pop(record["test_id"], None)
+            elif record["type"] == "subtest":
+                subtests.setdefault(record["test_id"], {})[record["public_id"]] = record
+            elif record["type"] == "test":
+                finished[record["test_id"]] = {
+                    "subtests": list(subtests.pop(record["test_id"], {}).values()),
+                    "phase_times": record["phase_times"],
+                }
+        return finished
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019-2020 by Andrey Ignatov. All Rights Reserved.
+
+import os
+import sys
+import logging
+import multiprocessing
+
+logger = logging.getLogger('ai_benchmark')
+
+# Rows added by init_resultCollector before the per-test rows, and by finish_resultCollector after them
+COLLECTOR_HEADER_ROWS = 2
+COLLECTOR_FOOTER_ROWS = 1
+
+
+def get_available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def get_cpu_sets(workers, cpus=None):
+
+    # Contiguous ranges of the CPU ids, which follow the sockets with the usual core numbering
+    cpus = sorted(cpus) if cpus is not None else get_available_cpus()
+    if not 0 < workers <= len(cpus):
+        raise ValueError("Cannot split %d CPUs between %d workers" % (len(cpus), workers))
+
+    size, extra = divmod(len(cpus), workers)
+    cpu_sets = []
+    start = 0
+    for worker in range(workers):
+        end = start + size + (1 if worker < extra else 0)
+        cpu_sets.append(cpus[start:end])
+        start = end
+    return cpu_sets
+
+
+def pin_cpus(cpus, cpu_count=None):
+    # Restricts the calling thread and the threads it starts next, e.g. the session thread pools, to the first CPUs
+    if cpu_count is not None and cpu_count < len(cpus):
+        if not hasattr(os, "sched_setaffinity"):
+            raise ValueError("Running a test on %d cores requires os.sched_setaffinity, not supported on %s"
+                             % (cpu_count, sys.platform))
+        cpus = cpus[:cpu_count]
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+def split_tests(test_ids, workers):
+    # Round robin over the suite order, which interleaves the light and heavy models
+    return [test_ids[worker::workers] for worker in range(workers)]
+
+
+def get_worker_args(cpu_set, kwargs):
+    # Thread pools sized to the pinned cores rather than the machine, unless set explicitly
+    return dict(kwargs, cpu_cores=len(cpu_set), inter_threads=kwargs.get("inter_threads") or len(cpu_set),
+                intra_threads=kwargs.get("intra_threads") or len(cpu_set), report=False)
+
+
+def import_resource():
+    # Unix only: the other modes, and the package itself, also work without it
+    try:
+        import resource
+    except ImportError:
+        raise ValueError("Memory limits require the resource module, not available on %s" % sys.platform)
+    return resource
+
+
+def set_memory_limit(memory_limit):
+    # Caps the heap and anonymous mappings (in MB), thread stacks included, not the file-backed mappings
+    # of the shared libraries counted by RLIMIT_AS
+    resource = import_resource()
+    limit = int(memory_limit * 1024 ** 2)
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+
+
+def run_worker(connection, cpu_set, test_ids, kwargs, memory_limit=None):
+
+    from ai_benchmark import utils
+
+    if cpu_set is not None:
+        os.sched_setaffinity(0, cpu_set)
+    if memory_limit is not None:
+        set_memory_limit(memory_limit)
+    logger.setLevel(30 - kwargs["verbose"] * 10)
+
+    try:
+        test_info, public_results, result_collector = utils.run_tests(test_ids=test_ids, **kwargs)
+        connection.send((test_info.results, public_results, list(result_collector), None))
+    except Exception as err:
+        connection.send((None, None, None, "%s: %s" % (type(err).__name__, err)))
+    finally:
+        connection.close()
+
+    # Hard stop: a call the watchdog gave up on must not keep the worker alive, or run during the next test
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def start_worker(context, cpu_set, test_ids, kwargs, name, memory_limit=None):
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_worker, args=(sender, cpu_set, test_ids, kwargs, memory_limit), name=name)
+    process.start()
+    # Only the worker holds the sending end, so that the pipe reports EOF if it dies
+    sender.close()
+    return process, receiver
+
+
+def receive_results(process, receiver, timeout=None):
+    try:
+        if not receiver.poll(timeout):
+            raise TimeoutError("%s timed out after %d s" % (process.name, timeout))
+        benchmark_results, public_results, result_collector, error = receiver.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError("%s exited with code %s" % (process.name, process.exitcode))
+    finally:
+        receiver.close()
+
+    if error is not None:
+        raise RuntimeError("%s failed: %s" % (process.name, error))
+    return benchmark_results, public_results, result_collector
+
+
+def get_test_order(public_id):
+    return tuple(int(i) for i in public_id.split("."))
+
+
+def merge_results(worker_results):
+
+    from ai_benchmark import utils
+
+    benchmark_results = utils.BenchmarkResults()
+    public_results = utils.PublicResults()
+    test_results = {}
+    result_collector = []
+
+    for results, public, collector in worker_results:
+        benchmark_results.results_inference_norm.extend(results.results_inference_norm)
+        benchmark_results.results_training_norm.extend(results.results_training_norm)
+        benchmark_results.results_inference.extend(results.results_inference)
+        benchmark_results.results_training.extend(results.results_training)
+        test_results.update(public.test_results)
+        public_results.phase_times.update(public.phase_times)
+
+        if not result_collector:
+            result_collector.extend(collector[:COLLECTOR_HEADER_ROWS])
+        result_collector.extend(collector[COLLECTOR_HEADER_ROWS:-COLLECTOR_FOOTER_ROWS])
+
+    public_results.test_results = dict(sorted(test_results.items(), key=lambda item: get_test_order(item[0])))
+    return benchmark_results, public_results, result_collector
+
+
+def stop_worker(process):
+    process.terminate()
+    process.join(1)
+    if process.is_alive():
+        process.kill()
+    process.join()
+
+
+def run_parallel(workers, test_ids=None, cpus=None, **kwargs):
+
+    from ai_benchmark import utils
+
+    if not hasattr(os, "sched_setaffinity"):
+        raise ValueError("Parallel workers are pinned to their CPUs, which is not supported on %s" % sys.platform)
+
+    test_ids = [str(test.id) for test in utils.TestConstructor().get_tests(test_ids)]
+    workers = min(workers, len(test_ids))
+    cpu_sets = get_cpu_sets(workers, cpus)
+    test_info = get_test_info(test_ids, kwargs)
+    # The workers share the machine: their results are not those of a single run
+    if workers > 1:
+        test_info.non_reference.append("workers")
+
+    # TensorFlow is not fork-safe: the workers start from a fresh interpreter
+    context = multiprocessing.get_context("spawn")
+    started = []
+    for worker, (cpu_set, worker_tests) in enumerate(zip(cpu_sets, split_tests(test_ids, workers))):
+        logger.info("Worker %d: tests %s on CPUs %s", worker, ", ".join(worker_tests),
+                    ", ".join(map(str, cpu_set)))
+        started.append(start_worker(context, cpu_set, worker_tests, get_worker_args(cpu_set, kwargs),
+                                    "ai-benchmark-worker-%d" % worker))
+
+    try:
+        worker_results = [receive_results(process, receiver) for process, receiver in started]
+    except Exception:
+        for process, receiver in started:
+            stop_worker(process)
+        raise
+    finally:
+        for process, receiver in started:
+            process.join()
+
+    public_results, result_collector = get_merged_results(test_info, worker_results, kwargs)
+    test_info.workers = workers
+    test_info.cpu_sets = cpu_sets
+    return test_info, public_results, result_collector
+
+
+def run_isolated(test_ids=None, memory_limit=None, timeout=None, **kwargs):
+
+    from ai_benchmark import utils
+
+    if memory_limit is not None:
+        import_resource()
+
+    test_ids = [str(test.id) for test in utils.TestConstructor().get_tests(test_ids)]
+    test_info = get_test_info(test_ids, kwargs)
+    context = multiprocessing.get_context("spawn")
+    worker_results = []
+    failed_tests = {}
+
+    # Every test starts from a fresh interpreter, a test that crashes, hangs or runs out of memory is skipped
+    for test_id in test_ids:
+        process, receiver = start_worker(context, None, [test_id], dict(kwargs, report=False),
+                                         "ai-benchmark-test-%s" % test_id, memory_limit)
+        try:
+            worker_results.append(receive_results(process, receiver, timeout))
+        except (RuntimeError, TimeoutError) as err:
+            logger.warning("Test %s skipped: %s", test_id, err)
+            failed_tests[test_id] = str(err)
+        finally:
+            stop_worker(process)
+
+    test_info.failed_tests = failed_tests
+    public_results, result_collector = get_merged_results(test_info, worker_results, kwargs)
+    return test_info, public_results, result_collector
+
+
+def get_test_info(test_ids, kwargs):
+
+    from ai_benchmark import utils
+
+    test_info = utils.TestInfo(kwargs["_type"], kwargs["precision"], kwargs["use_cpu"], kwargs["verbose"],
+                               kwargs.get("cpu_cores"), kwargs.get("inter_threads"), kwargs.get("intra_threads"))
+    test_info.full_suite = len(test_ids) == len(utils.TestConstructor.BENCHMARK_TESTS)
+    test_info.non_reference = utils.get_non_reference_settings(kwargs)
+    # The workers run with report=False: the launch and the scores are only reported once, for the whole run
+    if kwargs.get("report", True):
+        utils.print_test_info(test_info)
+    return test_info
+
+
+def get_merged_results(test_info, worker_results, kwargs):
+
+    from ai_benchmark import utils
+
+    benchmark_results, public_results, result_collector = merge_results(worker_results)
+
+    test_info.results = benchmark_results
+    public_results = utils.print_scores(test_info, public_results, kwargs.get("report", True))
+    result_collector.append({"row1": "AI-Score", "row2": benchmark_results.ai_score})
+
+    return public_results, result_collector
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019-2020 by Andrey Ignatov. All Rights Reserved.
+
+import time
+import queue
+import threading
+from concurrent import futures
+
+from ai_benchmark.stats_utils import relative_ci_width
+
+DEFAULT_TARGET_CI = 0.05
+ADAPTIVE_MIN_PASSES = 3
+
+
+class IterationScheduler:
+    """Runs a fixed number of iterations, cut short by the subtest time limits"""
+    def __init__(self, iterations, min_passes, max_duration, max_test_duration, run_all=False):
+        self.iterations = iterations
+        self.min_passes = min_passes
+        self.max_duration = max_duration
+        self.max_test_duration = max_test_duration
+        self.run_all = run_all
+        self.time_started = None
+
+    def elapsed(self):
+        if self.time_started is None:
+            self.time_started = time.monotonic()
+        return time.monotonic() - self.time_started
+
+    def should_run(self, samples):
+        i = len(samples)
+        if i >= self.iterations:
+            return False
+
+        elapsed = self.elapsed()
+        return elapsed < self.max_duration \
+            or (i < self.min_passes and elapsed < self.max_test_duration) \
+            or self.run_all
+
+
+class AdaptiveScheduler(IterationScheduler):
+    """Iterates until the confidence interval of the mean is narrow enough or the time budget runs out"""
+    def __init__(self, min_passes, time_budget, max_test_duration, target_ci=DEFAULT_TARGET_CI, max_iterations=None,
+                 mser=False):
+        super().__init__(max_iterations, max(min_passes, ADAPTIVE_MIN_PASSES), time_budget, max_test_duration)
+        self.target_ci = target_ci
+        # The interval of the mean that is reported: with or without the detected warmup
+        self.mser = mser
+
+    def should_run(self, samples):
+        i = len(samples)
+        if self.iterations is not None and i >= self.iterations:
+            return False
+
+        elapsed = self.elapsed()
+        if i < self.min_passes:
+            return elapsed < self.max_test_duration
+        if elapsed >= self.max_duration:
+            return False
+
+        return relative_ci_width(samples, mser=self.mser) > self.target_ci
+
+
+def get_time_ns():
+    # Monotonic high-resolution clock, not affected by system clock adjustments
+    try:
+        return time.perf_counter_ns()
+    except AttributeError:
+        return int(time.perf_counter() * 1e9)
+
+
+class Watchdog:
+    """Times the iterations in a separate thread, giving up on those that run past the deadline"""
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.calls = None
+        self.future = None
+
+    def __enter__(self):
+        if self.timeout:
+            # A call past the deadline cannot be interrupted: the daemon thread does not hold the interpreter at exit
+            self.calls = queue.Queue()
+            threading.Thread(target=self.serve, args=(self.calls,), name="ai-benchmark-watchdog", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.calls is not None:
+            self.calls.put(None)
+            self.calls = None
+
+    @staticmethod
+    def time(function):
+        time_started = get_time_ns()
+        function()
+        return (get_time_ns() - time_started) / 1e6
+
+    @staticmethod
+    def serve(calls):
+        for function, future in iter(calls.get, None):
+            try:
+                future.set_result(Watchdog.time(function))
+            except BaseException as err:
+                future.set_exception(err)
+
+    def run(self, function):
+        if self.calls is None:
+            return self.time(function)
+        self.future = futures.Future()
+        self.calls.put((function, self.future))
+        try:
+            return self.future.result(self.timeout)
+        except futures.TimeoutError:
+            raise TimeoutError("Iteration exceeded %g s" % self.timeout)
+
+    def wait(self, timeout=None):
+        # True once the last call has returned, e.g. after it was cancelled past the deadline
+        return self.future is None or not futures.wait([self.future], timeout).not_done
+
+    def is_running(self):
+        return not self.wait(0)
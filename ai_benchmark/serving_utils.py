@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019-2020 by Andrey Ignatov. All Rights Reserved.
+
+import copy
+import time
+import queue
+import logging
+import threading
+
+import numpy as np
+
+# Batch size from which the throughput is within this fraction of the best one
+SATURATION_THRESHOLD = 0.95
+
+STREAM_PERCENTILES = (50, 90, 99)
+
+# Offered loads of the open-loop sweep, relative to the closed-loop capacity
+LOAD_LEVELS = (0.1, 0.25, 0.5, 0.7, 0.8, 0.9, 1.0, 1.2)
+DEFAULT_LOAD_DURATION = 10
+# The knee is the highest offered load whose p99 latency stays within this factor of the lightest load
+KNEE_FACTOR = 2
+# Seconds the requests still queued after the last arrival are served for, the later ones are dropped
+MAX_DRAIN = 5
+
+# Maximum queueing delays of the dynamic batching policies, in ms
+DEFAULT_BATCH_TIMEOUTS = (2, 10)
+# Seconds of arrivals per batching policy: every subtest replays them for each policy
+DEFAULT_BATCHING_DURATION = 5
+# Offered load of the batching simulator, relative to the closed-loop throughput of the subtest
+BATCHING_LOAD = 0.8
+
+logger = logging.getLogger('ai_benchmark')
+
+
+def get_batch_sizes(batch_size, max_batch=None):
+    # Powers of two up to twice the configured batch size
+    max_batch = max_batch or batch_size * 2
+    batch_sizes = []
+    size = 1
+    while size < max_batch:
+        batch_sizes.append(size)
+        size *= 2
+    return batch_sizes + [max_batch]
+
+
+def get_sweep_subtest(subTest, batch_size):
+    sweep_subtest = copy.copy(subTest)
+    sweep_subtest.batch_size = batch_size
+    # Reference times are scaled with the batch, only to keep the scores defined
+    sweep_subtest.ref_time = subTest.ref_time * float(batch_size) / subTest.batch_size
+    return sweep_subtest
+
+
+def get_sweep_test(test, batch_sizes=None):
+
+    # The first inference subtest is swept, the text input of GNMT has a single fixed batch
+    subTest = test.inference[0]
+    if test.type == "nlp-text":
+        batch_sizes = [subTest.batch_size]
+
+    sweep_test = copy.copy(test)
+    sweep_test.inference = [get_sweep_subtest(subTest, batch_size)
+                            for batch_size in batch_sizes or get_batch_sizes(subTest.batch_size)]
+    return sweep_test
+
+
+def get_saturation_point(batch_sizes, throughputs, threshold=SATURATION_THRESHOLD):
+    best = max(throughputs)
+    for batch_size, throughput in zip(batch_sizes, throughputs):
+        if throughput >= best * threshold:
+            return batch_size
+
+
+def get_sweep_results(sweep_tests, public_results):
+
+    sweeps = {}
+    for test in sweep_tests:
+
+        batch_sizes, latencies, throughputs = [], [], []
+        for sub_id, subTest in enumerate(test.inference, 1):
+            result = public_results.test_results.get("%d.%d" % (test.id, sub_id))
+            if result is None or not result.mean > 0:
+                continue
+            batch_sizes.append(subTest.batch_size)
+            latencies.append(result.mean)
+            throughputs.append(1000. * subTest.batch_size / result.mean)
+
+        if batch_sizes:
+            sweeps[str(test.id)] = {
+                "model": test.model,
+                "batch_sizes": batch_sizes,
+                "latency": latencies,
+                "throughput": throughputs,
+                "saturation": get_saturation_point(batch_sizes, throughputs),
+            }
+    return sweeps
+
+
+def print_sweep_results(sweeps):
+    for test_id, sweep in sweeps.items():
+        logger.info("\n%s. %s", test_id, sweep["model"])
+        for batch_size, latency, throughput in zip(sweep["batch_sizes"], sweep["latency"], sweep["throughput"]):
+            logger.info("%s - batch=%d: %.1f ms, %.1f samples/s", test_id, batch_size, latency, throughput)
+        logger.info("%s - saturation | batch=%d", test_id, sweep["saturation"])
+
+
+def run_streams(run_request, streams, should_run):
+
+    # Closed loop: each stream issues its next request as soon as the previous one returns,
+    # until its own latencies meet the iteration budget, cut short by the shared time limits
+    latencies = [[] for stream in range(streams)]
+    samples = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(stream):
+        try:
+            while True:
+                with lock:
+                    if errors or not should_run(latencies[stream]):
+                        return
+                time_started = time.perf_counter()
+                run_request(stream)
+                latency = (time.perf_counter() - time_started) * 1000
+                with lock:
+                    latencies[stream].append(latency)
+                    samples.append(latency)
+        except Exception as err:
+            with lock:
+                errors.append(err)
+
+    threads = [threading.Thread(target=worker, args=(stream,), name="ai-benchmark-stream-%d" % stream)
+               for stream in range(streams)]
+
+    time_started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - time_started
+
+    if errors:
+        raise errors[0]
+    return latencies, samples, duration
+
+
+def get_latency_percentiles(latencies):
+    percentiles = np.percentile(latencies, STREAM_PERCENTILES) if len(latencies) else [np.nan] * len(STREAM_PERCENTILES)
+    return dict(("p%d" % q, float(value)) for q, value in zip(STREAM_PERCENTILES, percentiles))
+
+
+def get_stream_stats(latencies, duration, batch_size):
+    requests = sum(len(stream_latencies) for stream_latencies in latencies)
+    return {
+        "streams": len(latencies),
+        "throughput": requests * batch_size / duration if duration > 0 else np.nan,
+        "latency": get_latency_percentiles(np.concatenate(latencies)),
+        "stream_latency": [dict(get_latency_percentiles(stream_latencies), requests=len(stream_latencies))
+                           for stream_latencies in latencies],
+    }
+
+
+def print_stream_stats(prefix, stream_stats):
+    logger.info("%s | %d streams: %.1f samples/s, p50=%.1f, p99=%.1f ms", prefix, stream_stats["streams"],
+                stream_stats["throughput"], stream_stats["latency"]["p50"], stream_stats["latency"]["p99"])
+    for stream, stats in enumerate(stream_stats["stream_latency"]):
+        logger.debug("%s | stream %d: %d requests, p50=%.1f, p90=%.1f, p99=%.1f ms",
+                     prefix, stream, stats["requests"], stats["p50"], stats["p90"], stats["p99"])
+
+
+def get_load_rates(capacity, load_levels=LOAD_LEVELS):
+    return [capacity * level for level in load_levels]
+
+
+def get_arrival_times(rng, rate, duration):
+    # Poisson process: exponentially distributed inter-arrival times
+    count = max(int(np.ceil(rate * duration)), 1)
+    return np.cumsum(rng.exponential(1. / rate, count))
+
+
+class Drain:
+    """Deadline of the requests still queued once the arrivals are over"""
+    def __init__(self, max_drain=MAX_DRAIN):
+        self.max_drain = max_drain
+        self.deadline = None
+
+    def start(self):
+        self.deadline = time.perf_counter() + self.max_drain
+
+    def is_over(self):
+        return self.deadline is not None and time.perf_counter() > self.deadline
+
+
+def run_open_loop(run_request, arrival_times, workers=1, max_drain=MAX_DRAIN):
+
+    # Requests are queued at their scheduled arrival whether or not the previous ones are done, and
+    # latencies are measured from the scheduled arrival, so that a slow server cannot delay the
+    # requests it is measured with (coordinated omission). Dropped requests keep a NaN latency
+    requests = queue.Queue()
+    latencies = np.full(len(arrival_times), np.nan)
+    errors = []
+    drain = Drain(max_drain)
+
+    def worker(stream):
+        while True:
+            request = requests.get()
+            if request is None:
+                return
+            i, scheduled = request
+            if drain.is_over():
+                continue
+            try:
+                run_request(stream)
+            except Exception as err:
+                errors.append(err)
+                continue
+            latencies[i] = (time.perf_counter() - scheduled) * 1000
+
+    threads = [threading.Thread(target=worker, args=(stream,), name="ai-benchmark-server-%d" % stream)
+               for stream in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    time_started = schedule_arrivals(requests, arrival_times, errors)
+    drain.start()
+
+    for thread in threads:
+        requests.put(None)
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - time_started
+
+    if errors:
+        raise errors[0]
+    return latencies, duration
+
+
+def schedule_arrivals(requests, arrival_times, errors):
+    time_started = time.perf_counter()
+    for i, arrival_time in enumerate(arrival_times):
+        if errors:
+            break
+        scheduled = time_started + arrival_time
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        requests.put((i, scheduled))
+    return time_started
+
+
+def get_knee(load_curve, knee_factor=KNEE_FACTOR):
+    knee = None
+    for point in load_curve:
+        if point.get("dropped") or point["p99"] > load_curve[0]["p99"] * knee_factor:
+            break
+        knee = point["qps"]
+    return knee
+
+
+def run_load_test(run_request, rates, duration=DEFAULT_LOAD_DURATION, workers=1, seed=42, max_drain=MAX_DRAIN):
+
+    rng = np.random.default_rng(seed)
+    points = []
+    for rate in sorted(rates):
+        latencies, elapsed = run_open_loop(run_request, get_arrival_times(rng, rate, duration), workers, max_drain)
+        completed = latencies[~np.isnan(latencies)]
+        point = {"qps": rate, "throughput": len(completed) / elapsed, "dropped": len(latencies) - len(completed)}
+        point.update(get_latency_percentiles(completed))
+        points.append(point)
+
+    return {"workers": workers, "points": points, "knee": get_knee(points) if points else None}
+
+
+def print_load_curve(prefix, load_curve):
+    for point in load_curve["points"]:
+        logger.info("%s | offered %.2f qps: %.2f qps, p50=%.1f, p99=%.1f ms, %d dropped",
+                    prefix, point["qps"], point["throughput"], point["p50"], point["p99"], point["dropped"])
+    if load_curve["knee"] is not None:
+        logger.info("%s | knee at %.2f qps", prefix, load_curve["knee"])
+
+
+def get_max_batches(batch_size):
+    # Powers of four up to the configured batch size, e.g. 1, 4, 16 and 50
+    max_batches = []
+    size = 1
+    while size < batch_size:
+        max_batches.append(size)
+        size *= 4
+    return max_batches + [batch_size]
+
+
+def get_batching_policies(batch_size, max_batches=None, timeouts=None):
+    return [(max_batch, timeout) for max_batch in max_batches or get_max_batches(batch_size)
+            for timeout in timeouts or DEFAULT_BATCH_TIMEOUTS]
+
+
+def get_next_batch(requests, max_batch, timeout):
+
+    # Waits for the first request, then for more until the batch is full or the first request has waited
+    # the timeout. Returns the batch and whether the arrivals are over
+    first = requests.get()
+    if first is None:
+        return [], True
+    batch = [first]
+    deadline = first[1] + timeout / 1000.
+
+    while len(batch) < max_batch:
+        remaining = deadline - time.perf_counter()
+        try:
+            request = requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait()
+        except queue.Empty:
+            break
+        if request is None:
+            return batch, True
+        batch.append(request)
+    return batch, False
+
+
+def run_dynamic_batching(run_batch, arrival_times, max_batch, timeout, max_drain=MAX_DRAIN):
+
+    # Single-sample requests arrive open-loop, a single server runs them in batches of up to max_batch.
+    # As in run_open_loop, the requests left when the drain is over are dropped
+    requests = queue.Queue()
+    latencies = np.full(len(arrival_times), np.nan)
+    batch_sizes = []
+    errors = []
+    drain = Drain(max_drain)
+
+    def server():
+        done = False
+        while not done:
+            batch, done = get_next_batch(requests, max_batch, timeout)
+            if not batch or drain.is_over():
+                continue
+            try:
+                run_batch(len(batch))
+            except Exception as err:
+                errors.append(err)
+                return
+            time_finished = time.perf_counter()
+            for i, scheduled in batch:
+                latencies[i] = (time_finished - scheduled) * 1000
+            batch_sizes.append(len(batch))
+
+    thread = threading.Thread(target=server, name="ai-benchmark-batching")
+    thread.start()
+    time_started = schedule_arrivals(requests, arrival_times, errors)
+    drain.start()
+    requests.put(None)
+    thread.join()
+    duration = time.perf_counter() - time_started
+
+    if errors:
+        raise errors[0]
+    return latencies, batch_sizes, duration
+
+
+def run_batching_test(run_batch, rate, policies, duration=DEFAULT_BATCHING_DURATION, seed=42, max_drain=MAX_DRAIN):
+
+    # The same arrivals are replayed for every policy
+    arrival_times = get_arrival_times(np.random.default_rng(seed), rate, duration)
+    results = []
+    for max_batch, timeout in policies:
+        latencies, batch_sizes, elapsed = run_dynamic_batching(run_batch, arrival_times, max_batch, timeout, max_drain)
+        completed = latencies[~np.isnan(latencies)]
+        result = {
+            "max_batch": max_batch,
+            "timeout": timeout,
+            "throughput": len(completed) / elapsed,
+            "dropped": len(latencies) - len(completed),
+            "mean_batch": float(np.mean(batch_sizes)) if batch_sizes else np.nan,
+        }
+        result.update(get_latency_percentiles(completed))
+        results.append(result)
+
+    return {"qps": rate, "policies": results}
+
+
+def print_batching_results(prefix, batching):
+    logger.info("%s | dynamic batching at %.1f qps", prefix, batching["qps"])
+    for result in batching["policies"]:
+        logger.info("%s | max_batch=%d, timeout=%g ms: %.1f samples/s, mean batch=%.1f, p50=%.1f, p99=%.1f ms, "
+                    "%d dropped", prefix, result["max_batch"], result["timeout"], result["throughput"],
+                    result["mean_batch"], result["p50"], result["p99"], result["dropped"])
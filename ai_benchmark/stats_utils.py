@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019-2020 by Andrey Ignatov. All Rights Reserved.
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+CONFIDENCE_LEVEL = 0.95
+# Two-sided normal quantile of CONFIDENCE_LEVEL, used for the fast convergence checks
+Z_SCORE = 1.959963984540054
+BOOTSTRAP_RESAMPLES = 1000
+
+# Modified z-score threshold for the MAD-based outlier rejection (Iglewicz and Hoaglin)
+MAD_THRESHOLD = 3.5
+MAD_SCALE = 1.4826
+
+
+class Statistics:
+    def __init__(self, samples, warmup, outliers, mean, std, percentiles, ci):
+        self.samples = samples
+        self.warmup = warmup
+        self.outliers = outliers
+        self.mean = mean
+        self.std = std
+        self.p50, self.p90, self.p99 = percentiles
+        self.ci_low, self.ci_high = ci
+
+    @property
+    def n(self):
+        return len(self.samples)
+
+
+def detect_warmup(samples, min_warmup=1):
+
+    # MSER: truncate the prefix that minimizes the standard error of the remaining
+    # samples, looking at most at the first half of the run
+    samples = np.asarray(samples, dtype=np.float64)
+    n = len(samples)
+    if n <= min_warmup + 1:
+        return min(min_warmup, max(n - 1, 0))
+
+    # Variances of all suffixes at once from reversed cumulative sums
+    centered = samples - samples.mean()
+    counts = np.arange(n, 0, -1)
+    sums = np.cumsum(centered[::-1])[::-1]
+    squares = np.cumsum(centered[::-1] ** 2)[::-1]
+    scores = (squares / counts - (sums / counts) ** 2) / counts
+
+    last = n // 2 + 1
+    return min_warmup + int(np.argmin(scores[min_warmup:last]))
+
+
+def get_warmup(samples, min_warmup=1, mser=False):
+    # The first min_warmup samples, as dropped by the reference results, unless the warmup is detected
+    if mser:
+        return detect_warmup(samples, min_warmup)
+    return min(min_warmup, max(len(samples) - 1, 0))
+
+
+def reject_outliers(samples, threshold=MAD_THRESHOLD):
+
+    samples = np.asarray(samples, dtype=np.float64)
+    if len(samples) < 3:
+        return samples
+
+    median = np.median(samples)
+    mad = np.median(np.abs(samples - median)) * MAD_SCALE
+    if mad == 0:
+        return samples
+
+    return samples[np.abs(samples - median) / mad <= threshold]
+
+
+def bootstrap_ci(samples, confidence=CONFIDENCE_LEVEL, resamples=BOOTSTRAP_RESAMPLES, seed=0):
+
+    samples = np.asarray(samples, dtype=np.float64)
+    if len(samples) < 2:
+        mean = samples.mean() if len(samples) else np.nan
+        return mean, mean
+
+    rng = np.random.default_rng(seed)
+    means = samples[rng.integers(len(samples), size=(resamples, len(samples)))].mean(axis=1)
+    alpha = (1 - confidence) / 2
+    return tuple(np.quantile(means, [alpha, 1 - alpha]))
+
+
+def relative_ci_width(samples, min_warmup=1, mser=False):
+
+    # Normal approximation of the confidence interval of the steady-state mean,
+    # cheap enough to be evaluated after every iteration
+    samples = np.asarray(samples, dtype=np.float64)
+    steady = samples[get_warmup(samples, min_warmup, mser):]
+    if len(steady) < 2 or steady.mean() <= 0:
+        return np.inf
+
+    return 2 * Z_SCORE * steady.std(ddof=1) / np.sqrt(len(steady)) / steady.mean()
+
+
+def compute_statistics(samples, outlier_rejection=False, min_warmup=1, mser=False):
+
+    samples = np.asarray(samples, dtype=np.float64)
+    warmup = get_warmup(samples, min_warmup, mser)
+    steady = samples[warmup:]
+
+    outliers = 0
+    if outlier_rejection:
+        kept = reject_outliers(steady)
+        outliers = len(steady) - len(kept)
+        steady = kept
+
+    if len(steady) == 0:
+        return Statistics(samples, warmup, outliers, np.nan, np.nan, [np.nan] * len(PERCENTILES), (np.nan, np.nan))
+
+    return Statistics(
+        samples,
+        warmup,
+        outliers,
+        steady.mean(),
+        steady.std(),
+        np.percentile(steady, PERCENTILES),
+        bootstrap_ci(steady),
+    )
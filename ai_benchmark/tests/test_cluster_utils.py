@@ -0,0 +1,102 @@
+import time
+import threading
+import unittest
+from ai_benchmark import cluster_utils
+
+
+def run_job(job):
+    if job["test_id"] == "3":
+        raise RuntimeError("OOM")
+    norm = 2. if job["config"]["precision"] == "high" else 1.
+    return {
+        "job_id": job["id"],
+        "test_id": job["test_id"],
+        "environment": {"cpu": "test"},
+        "test_results": {"%s.1" % job["test_id"]: {"mean": 10.}},
+        "inference_norm": [norm],
+        "training_norm": [],
+        "error": None,
+    }
+
+
+def run_cluster(test_ids, hosts, distribute=False):
+    coordinator = cluster_utils.Coordinator(test_ids, {"precision": "high"}, len(hosts), distribute)
+    port = coordinator.start("127.0.0.1", 0)
+    jobs = {}
+
+    def work(worker, host):
+        jobs[worker] = cluster_utils.run_worker("127.0.0.1:%d" % port, run_job, {"cpu": "test"}, host, 5)
+
+    workers = [threading.Thread(target=work, args=(worker, host)) for worker, host in enumerate(hosts)]
+    for worker in workers:
+        worker.start()
+    try:
+        results = coordinator.wait(10)
+    finally:
+        for worker in workers:
+            worker.join()
+        coordinator.stop()
+    return results, jobs
+
+
+class CoordinatorTest(unittest.TestCase):
+    def test_every_host_runs_every_test(self):
+        results, jobs = run_cluster(["1", "2"], ["a", "b"])
+
+        self.assertEqual(jobs, {0: 2, 1: 2})
+        for host in ("a", "b"):
+            self.assertEqual(sorted(results[host]["test_results"]), ["1.1", "2.1"])
+            self.assertEqual(results[host]["inference_score"], 20000)
+            self.assertEqual(results[host]["environment"], {"cpu": "test"})
+
+    def test_distributed_tests(self):
+        results, jobs = run_cluster(["1", "2", "4"], ["a", "b"], distribute=True)
+
+        self.assertEqual(sum(jobs.values()), 3)
+        self.assertEqual(sorted(public_id for entry in results.values() for public_id in entry["test_results"]),
+                         ["1.1", "2.1", "4.1"])
+
+    def test_failed_jobs_are_reported(self):
+        results, jobs = run_cluster(["1", "3"], ["a"])
+
+        self.assertEqual(list(results["a"]["test_results"]), ["1.1"])
+        self.assertIn("OOM", results["a"]["failed_tests"]["3"])
+
+    def test_workers_with_the_same_name(self):
+        results, jobs = run_cluster(["1", "2"], ["a", "a"])
+
+        self.assertEqual(jobs, {0: 2, 1: 2})
+        self.assertEqual(sorted(results), ["a", "a-2"])
+
+    def test_jobs_of_lost_workers_are_handed_out_again(self):
+        coordinator = cluster_utils.Coordinator(["1", "2"], {}, 2, distribute=True, lease_timeout=0)
+        lost = coordinator.register("a")["worker"]
+        job = coordinator.next_job(lost)["job"]
+        coordinator.expire_leases()
+
+        worker = coordinator.register("b")["worker"]
+        self.assertEqual(coordinator.next_job(worker)["job"]["test_id"], job["test_id"])
+        self.assertEqual(coordinator.lost, {lost})
+
+    def test_heartbeats_keep_the_lease(self):
+        coordinator = cluster_utils.Coordinator(["1"], {"precision": "high"}, 1, lease_timeout=0.5)
+        port = coordinator.start("127.0.0.1", 0)
+        slow_job = lambda job: time.sleep(1.5) or run_job(job)
+        worker = threading.Thread(target=cluster_utils.run_worker, args=("127.0.0.1:%d" % port, slow_job, {}, "a", 5, 0.1))
+        worker.start()
+        try:
+            results = coordinator.wait(10)
+        finally:
+            worker.join()
+            coordinator.stop()
+
+        self.assertEqual(list(results["a"]["test_results"]), ["1.1"])
+        self.assertEqual(coordinator.lost, set())
+
+    def test_local_settings_are_not_sent(self):
+        coordinator = cluster_utils.Coordinator(["1"], {"precision": "high", "data_store": "/data", "journal": None})
+        self.assertEqual(coordinator.config, {"precision": "high"})
+
+    def test_score_ignores_missing_results(self):
+        self.assertEqual(cluster_utils.get_score([1., 4., float("nan")]), 20000)
+        self.assertEqual(cluster_utils.get_score([]), 0)
@@ -1,10 +1,43 @@
+import json
 import unittest
+import numpy as np
 from ai_benchmark import console
 
 
 class MainTest(unittest.TestCase):
-    # @unittest.mock.patch('sys.argv', [])
+    @unittest.mock.patch('sys.argv', ['ai-benchmark'])
     @unittest.mock.patch('ai_benchmark.AIBenchmark.run')
     def test_func(self, mock_run):
+        mock_run.return_value = (unittest.mock.Mock(), unittest.mock.Mock(), [])
         console.main()
         self.assertTrue(mock_run.called)
+
+    @unittest.mock.patch('sys.argv', ['ai-benchmark', 'tune', '-t', '1', '--tune-intra', '1', '2'])
+    @unittest.mock.patch('ai_benchmark.AIBenchmark.tune')
+    def test_tune(self, mock_tune):
+        mock_tune.return_value = {}
+        console.main()
+        self.assertEqual(mock_tune.call_args[1]['intra_threads'], [1, 2])
+        self.assertEqual(mock_tune.call_args[1]['test_ids'], ['1'])
+
+    @unittest.mock.patch('sys.argv', ['ai-benchmark', 'compare', '--grappler', 'layout=off'])
+    @unittest.mock.patch('ai_benchmark.AIBenchmark.compare')
+    def test_compare(self, mock_compare):
+        mock_compare.return_value = {}
+        console.main()
+        self.assertEqual(mock_compare.call_args[1]['grappler'], {'layout': 'off'})
+        self.assertFalse(mock_compare.call_args[1]['xla'])
+
+    @unittest.mock.patch('sys.argv', ['ai-benchmark', 'worker', '--coordinator', 'localhost:8642', '--worker-name', 'a',
+                                      '--data-store', '/data'])
+    @unittest.mock.patch('ai_benchmark.AIBenchmark.work')
+    def test_worker(self, mock_work):
+        console.main()
+        mock_work.assert_called_once_with('localhost:8642', host='a', data_store='/data', graph_cache=None,
+                                          profile=None, journal=None, resume=False)
+
+
+class JsonDefaultTest(unittest.TestCase):
+    def test_numpy_samples(self):
+        output = json.dumps({"samples": np.array([1.5, 2.25]), "mean": np.float64(1.875)}, default=console.json_default)
+        self.assertEqual(json.loads(output), {"samples": [1.5, 2.25], "mean": 1.875})
@@ -0,0 +1,138 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from ai_benchmark import data_utils
+
+
+class DataCacheTest(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = data_utils.DataCache(max_size_mb=2 * 8 * 1024 / 1024. ** 2)
+        loader = unittest.mock.Mock(side_effect=lambda: np.zeros(1024))
+
+        cache.get("a", loader)
+        cache.get("b", loader)
+        cache.get("a", loader)
+        cache.get("c", loader)
+
+        self.assertEqual(loader.call_count, 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.size, 2 * 8 * 1024)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_cached_arrays_are_read_only(self):
+        cache = data_utils.DataCache()
+        data = cache.get("a", lambda: np.zeros(4))
+        self.assertFalse(data.flags.writeable)
+
+    def test_disabled_cache(self):
+        cache = data_utils.DataCache(max_size_mb=0)
+        loader = unittest.mock.Mock(side_effect=lambda: np.zeros(4))
+        cache.get("a", loader)
+        cache.get("a", loader)
+        self.assertEqual(loader.call_count, 2)
+        self.assertEqual(len(cache), 0)
+
+    def test_pinned_entries_are_never_evicted(self):
+        cache = data_utils.DataCache(max_size_mb=8 * 1024 / 1024. ** 2)
+        loader = unittest.mock.Mock(side_effect=lambda: np.zeros(1024))
+
+        cache.get("synthetic", loader, pinned=True)
+        cache.get("a", loader)
+        cache.get("b", loader)
+        cache.get("synthetic", loader, pinned=True)
+
+        self.assertEqual(loader.call_count, 3)
+        self.assertIn("synthetic", cache)
+        self.assertNotIn("a", cache)
+        self.assertEqual((cache.size, cache.pinned_size), (8 * 1024, 8 * 1024))
+
+        cache.clear_pinned()
+        self.assertNotIn("synthetic", cache)
+        self.assertEqual(cache.pinned_size, 0)
+
+
+class DatasetStoreTest(unittest.TestCase):
+    def test_relative_root_is_resolved(self):
+        store = data_utils.DatasetStore("store")
+        self.assertEqual(os.path.dirname(store.root), os.path.join(os.getcwd(), "store"))
+
+    def test_batches_are_memory_mapped_slices(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = data_utils.DatasetStore(root)
+            loader = unittest.mock.Mock(side_effect=lambda: np.arange(4 * 6.).reshape(4, 2, 3))
+
+            data = store.load("data", "classification", [4, 2, 3], np.float64, loader)
+            subset = store.load("data", "classification", [2, 2, 3], np.float64, loader)
+
+            self.assertEqual(loader.call_count, 1)
+            self.assertIsInstance(subset, np.memmap)
+            np.testing.assert_array_equal(subset, data[:2])
+
+    def test_random_data_is_not_stored(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = data_utils.DatasetStore(root)
+            store.load("data", "nlp", [1, 2, 3], np.float64, lambda: np.zeros((1, 2, 3)))
+            self.assertFalse(os.path.exists(store.root))
+
+    def test_fingerprint_follows_the_file_contents(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            file_path = os.path.join(data_dir, "image.jpg")
+            with open(file_path, "wb") as f:
+                f.write(b"aaaa")
+            fingerprint = data_utils.get_data_fingerprint(data_dir)
+            self.assertEqual(data_utils.get_data_fingerprint(data_dir), fingerprint)
+
+            # Same size, only the contents and the modification time change
+            stat = os.stat(file_path)
+            with open(file_path, "wb") as f:
+                f.write(b"bbbb")
+            os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+            self.assertNotEqual(data_utils.get_data_fingerprint(data_dir), fingerprint)
+
+
+class PrefetcherTest(unittest.TestCase):
+    def test_batches_are_returned_in_order(self):
+        batches = iter(range(100))
+        with data_utils.Prefetcher(lambda: next(batches), depth=2) as prefetcher:
+            self.assertEqual([prefetcher.get() for i in range(5)], [0, 1, 2, 3, 4])
+
+    def test_loader_errors_are_raised_by_get(self):
+        loader = unittest.mock.Mock(side_effect=IOError("broken image"))
+        with data_utils.Prefetcher(loader, depth=2) as prefetcher:
+            self.assertRaises(IOError, prefetcher.get)
+
+    def test_synchronous_mode(self):
+        loader = unittest.mock.Mock(return_value=1)
+        with data_utils.Prefetcher(loader, depth=0) as prefetcher:
+            prefetcher.get()
+        self.assertEqual(loader.call_count, 1)
+
+
+class LoadImageBatchTest(unittest.TestCase):
+    def test_batch_is_contiguous_float32(self):
+        dimensions = [4, 96, 128, 3]
+        data = data_utils.load_image_batch(data_utils.get_image_paths("enhancement", 4), dimensions)
+        self.assertEqual(list(data.shape), dimensions)
+        self.assertEqual(data.dtype, np.float32)
+        self.assertTrue(data.flags.c_contiguous)
+        self.assertGreater(data.max(), 0)
+
+    def test_large_batches_reuse_the_images(self):
+        count = data_utils.get_image_count("segmentation")
+        file_paths = data_utils.get_image_paths("segmentation", count + 1, "_segmented")
+        self.assertEqual(file_paths[count], file_paths[0])
+        self.assertTrue(all(os.path.exists(file_path) for file_path in file_paths))
+
+
+class SyntheticDataTest(unittest.TestCase):
+    def test_generated_data_is_seeded_float32(self):
+        first = data_utils.generate_data(np.random.default_rng(1), "classification", [2, 8, 8, 3])
+        second = data_utils.generate_data(np.random.default_rng(1), "classification", [2, 8, 8, 3])
+        self.assertEqual(first.dtype, np.float32)
+        np.testing.assert_array_equal(first, second)
+
+    def test_generated_one_hot_targets(self):
+        targets = data_utils.generate_targets(np.random.default_rng(1), "nlp", [10, 2])
+        np.testing.assert_array_equal(targets.sum(axis=1), np.ones(10))
@@ -0,0 +1,150 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import tensorflow as tf
+from ai_benchmark import graph_utils
+
+
+class StagedInputTest(unittest.TestCase):
+    def test_batch_is_staged_once(self):
+        with tf.Graph().as_default(), tf.compat.v1.Session() as sess:
+            input_ = graph_utils.create_input(tf.float32, [None, 2], "graph")
+            output_ = graph_utils.get_tensor(input_) * 2
+            sess.run(tf.compat.v1.global_variables_initializer())
+
+            batches = unittest.mock.Mock()
+            batches.get.return_value = [np.ones((3, 2), dtype=np.float32)]
+
+            feed_dict = None
+            for i in range(3):
+                feed_dict = graph_utils.next_feed_dict(sess, [input_], batches, feed_dict)
+                np.testing.assert_array_equal(sess.run(output_, feed_dict=feed_dict), np.full((3, 2), 2))
+
+            self.assertEqual(batches.get.call_count, 1)
+            self.assertEqual(feed_dict, {})
+
+    def test_string_inputs_are_fed(self):
+        with tf.Graph().as_default():
+            input_ = graph_utils.create_input(tf.string, [None], "graph")
+            self.assertNotIsInstance(input_, graph_utils.StagedInput)
+
+
+class MetaGraphCacheTest(unittest.TestCase):
+    def test_relative_cache_dir_is_resolved(self):
+        self.assertEqual(graph_utils.MetaGraphCache("cache").cache_dir, os.path.join(os.getcwd(), "cache"))
+
+    def test_graphs_are_cached_in_memory_and_on_disk(self):
+        with tempfile.TemporaryDirectory() as root:
+            model_src = os.path.join(root, "model.meta")
+            with tf.Graph().as_default():
+                with tf.device("/cpu:0"):
+                    input_ = tf.compat.v1.placeholder(tf.float32, [None, 2], name="input")
+                    tf.identity(input_ * 2, name="output")
+                tf.compat.v1.train.export_meta_graph(model_src)
+
+            cache = graph_utils.MetaGraphCache(os.path.join(root, "cache"))
+            meta_graph_def = cache.load(model_src)
+            self.assertIs(cache.load(model_src), meta_graph_def)
+            self.assertTrue(all(node.device == "" for node in meta_graph_def.graph_def.node))
+            self.assertTrue(os.path.exists(cache.get_cache_path(model_src)))
+
+            with unittest.mock.patch.dict(graph_utils._META_GRAPHS, clear=True), \
+                    unittest.mock.patch('ai_benchmark.graph_utils.read_meta_graph') as read_meta_graph:
+                self.assertEqual(cache.load(model_src), meta_graph_def)
+                self.assertFalse(read_meta_graph.called)
+
+            with tf.Graph().as_default(), tf.compat.v1.Session() as sess:
+                tf.compat.v1.train.import_meta_graph(meta_graph_def)
+                output = sess.run("output:0", feed_dict={"input:0": np.ones((1, 2))})
+                np.testing.assert_array_equal(output, [[2, 2]])
+
+    def test_frozen_graphs_are_pruned_to_the_output(self):
+        with tempfile.TemporaryDirectory() as root:
+            model_src = os.path.join(root, "model.meta")
+            with tf.Graph().as_default():
+                input_ = tf.compat.v1.placeholder(tf.float32, [None, 2], name="input")
+                weights = tf.compat.v1.Variable(tf.fill([2], 3.), name="weights")
+                output_ = tf.identity(input_ * weights, name="output")
+                tf.compat.v1.train.AdamOptimizer().minimize(tf.reduce_sum(output_))
+                tf.compat.v1.train.Saver()
+                tf.compat.v1.train.export_meta_graph(model_src)
+
+            cache = graph_utils.MetaGraphCache(os.path.join(root, "cache"))
+            graph_def = cache.load_frozen(model_src)
+            self.assertTrue(os.path.exists(cache.get_cache_path(model_src, "frozen.pb")))
+            self.assertFalse([node.name for node in graph_def.node if "Variable" in node.op or "save" in node.name
+                              or "Adam" in node.name])
+
+            with tf.Graph().as_default(), tf.compat.v1.Session() as sess:
+                tf.compat.v1.import_graph_def(graph_def, name="")
+                output = sess.run("output:0", feed_dict={"input:0": np.ones((1, 2))})
+                np.testing.assert_array_equal(output, [[3, 3]])
+
+    def test_unfreezable_graphs_are_remembered_on_disk(self):
+        with tempfile.TemporaryDirectory() as root:
+            model_src = os.path.join(root, "model.meta")
+            with tf.Graph().as_default():
+                input_ = tf.compat.v1.placeholder(tf.float32, [None, 2], name="input")
+                weights = tf.compat.v1.Variable(tf.fill([2], 3.), name="weights")
+                tf.identity(input_ * weights.assign(weights * 2), name="output")
+                tf.compat.v1.train.export_meta_graph(model_src)
+
+            cache = graph_utils.MetaGraphCache(os.path.join(root, "cache"))
+            self.assertIsNone(cache.load_frozen(model_src))
+            cache_path = cache.get_cache_path(model_src, "frozen.pb")
+            self.assertTrue(os.path.exists(cache_path + graph_utils.UNAVAILABLE_SUFFIX))
+            self.assertFalse(os.path.exists(cache_path))
+
+            with unittest.mock.patch.dict(graph_utils._META_GRAPHS, clear=True), \
+                    unittest.mock.patch('ai_benchmark.graph_utils.freeze_graph') as freeze_graph:
+                self.assertIsNone(cache.load_frozen(model_src))
+                self.assertFalse(freeze_graph.called)
+
+
+class GraphOptionsTest(unittest.TestCase):
+    @unittest.mock.patch.dict(os.environ)
+    def test_xla_and_grappler_options(self):
+        config = graph_utils.set_graph_options(tf.compat.v1.ConfigProto(), xla=True,
+                                               grappler={"layout": "off", "arithmetic": "aggressive"})
+        self.assertEqual(config.graph_options.optimizer_options.global_jit_level, tf.compat.v1.OptimizerOptions.ON_1)
+        rewrite_options = config.graph_options.rewrite_options
+        self.assertEqual(rewrite_options.layout_optimizer, rewrite_options.OFF)
+        self.assertEqual(rewrite_options.arithmetic_optimization, rewrite_options.AGGRESSIVE)
+
+    def test_unknown_optimizer(self):
+        self.assertRaises(ValueError, graph_utils.set_graph_options, tf.compat.v1.ConfigProto(), grappler={"loop": "on"})
+
+    def test_function_options(self):
+        graph_utils.set_function_options(grappler={"layout": "off"})
+        self.assertIs(tf.config.optimizer.get_experimental_options()["layout_optimizer"], False)
+        graph_utils.set_function_options()
+        self.assertNotIn("layout_optimizer", tf.config.optimizer.get_experimental_options())
+        self.assertRaises(ValueError, graph_utils.set_function_options, grappler={"arithmetic": "aggressive"})
+
+
+class FunctionCallTest(unittest.TestCase):
+    def test_frozen_graph_is_called_eagerly(self):
+        with tf.Graph().as_default() as graph:
+            input_ = tf.compat.v1.placeholder(tf.float32, [None, 2], name="input")
+            tf.identity(input_ * 2, name="output")
+
+        batches = unittest.mock.Mock()
+        batches.get.return_value = [np.ones((3, 2), dtype=np.float32)]
+
+        # Called from the graph context of the test session, as in run_tests
+        with tf.Graph().as_default():
+            call = graph_utils.FunctionCall(graph_utils.wrap_frozen_graph(graph.as_graph_def()), "graph")
+            for i in range(3):
+                call.next_batch(batches)
+                np.testing.assert_array_equal(call(), np.full((3, 2), 2))
+
+        self.assertEqual(batches.get.call_count, 1)
+
+    def test_function_is_placed_on_the_device(self):
+        with tf.Graph().as_default() as graph:
+            input_ = tf.compat.v1.placeholder(tf.float32, [None, 2], name="input")
+            tf.identity(input_ * 2, name="output")
+
+        function = graph_utils.wrap_frozen_graph(graph.as_graph_def(), device="/CPU:0")
+        self.assertTrue(all(op.device.endswith("CPU:0") for op in function.graph.get_operations()))
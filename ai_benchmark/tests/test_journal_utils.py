@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from ai_benchmark import journal_utils
+from ai_benchmark import utils
+
+ENVIRONMENT = {"cpu": "test", "cpu_cores": 4}
+CONFIG = {"precision": "normal"}
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.tmp_dir.name, "journal.jsonl")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_test(self, journal, test_id, finished=True, mean=10.):
+        result = utils.Result(mean, 1., np.array([9., 11.]))
+        journal.start_test(test_id)
+        journal.add_subtest(test_id, "%s.1" % test_id, "inference", result, 2.)
+        if finished:
+            journal.add_test(test_id, {"warmup": 9.})
+
+    def test_finished_tests_are_loaded(self):
+        journal = journal_utils.Journal(self.file_path, ENVIRONMENT, CONFIG)
+        self.write_test(journal, 1)
+        self.write_test(journal, 2, finished=False)
+
+        finished = journal_utils.Journal(self.file_path, ENVIRONMENT, CONFIG).load()
+        self.assertEqual(list(finished), ["1"])
+        record = finished["1"]["subtests"][0]
+        self.assertEqual((record["public_id"], record["norm"]), ("1.1", 2.))
+        self.assertEqual(record["result"]["samples"], [9., 11.])
+        self.assertEqual(finished["1"]["phase_times"], {"warmup": 9.})
+
+    def test_other_settings_are_not_resumed(self):
+        self.write_test(journal_utils.Journal(self.file_path, ENVIRONMENT, CONFIG), 1)
+        self.assertEqual(journal_utils.Journal(self.file_path, ENVIRONMENT, {"precision": "high"}).load(), {})
+        self.assertEqual(journal_utils.Journal(self.file_path, dict(ENVIRONMENT, cpu_cores=8), CONFIG).load(), {})
+
+    def test_truncated_record_is_skipped(self):
+        journal = journal_utils.Journal(self.file_path, ENVIRONMENT, CONFIG)
+        self.write_test(journal, 1)
+        with open(self.file_path, "a") as f:
+            f.write('{"type": "subtest", "test_id": "2"')
+
+        self.assertEqual(list(journal.load()), ["1"])
+
+    def test_resume_after_a_truncated_record(self):
+        journal = journal_utils.Journal(self.file_path, ENVIRONMENT, CONFIG)
+        self.write_test(journal, 1)
+        self.write_test(journal, 2, finished=False, mean=1.)
+        journal.add_subtest(2, "2.2", "training", utils.Result(1., 1., np.array([1.])), None)
+        with open(self.file_path, "a") as f:
+            f.write('{"type": "subtest", "test_id": "2"')
+
+        # The resumed run starts test 2 over: only the subtests of its last attempt are kept
+        journal = journal_utils.Journal(self.file_path, ENVIRONMENT, CONFIG)
+        self.write_test(journal, 2, mean=6.)
+
+        finished = journal.load()
+        self.assertEqual(list(finished), ["1", "2"])
+        self.assertEqual([(record["public_id"], record["result"]["mean"]) for record in finished["2"]["subtests"]],
+                         [("2.1", 6.)])
+
+    def test_missing_journal(self):
+        self.assertEqual(journal_utils.Journal(self.file_path, ENVIRONMENT, CONFIG).load(), {})
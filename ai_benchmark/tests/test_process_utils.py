@@ -0,0 +1,121 @@
+import os
+import time
+import threading
+import unittest
+import multiprocessing
+import numpy as np
+from ai_benchmark import process_utils
+from ai_benchmark import utils
+
+
+def get_worker_results(test_ids, norm):
+    results = utils.BenchmarkResults()
+    results.results_inference_norm = [norm] * len(test_ids)
+    public_results = utils.PublicResults()
+    public_results.test_results = dict(("%s.1" % test_id, utils.Result(1., 0.)) for test_id in test_ids)
+    collector = [{"row1": "hardware"}, {"row1": "TF Build"}] + [{"row1": test_id} for test_id in test_ids] + \
+        [{"row1": "AI-Score"}]
+    return results, public_results, collector
+
+
+def hang(connection):
+    time.sleep(60)
+
+
+def crash(connection):
+    os._exit(3)
+
+
+def allocate(connection, memory_limit):
+    process_utils.set_memory_limit(memory_limit)
+    try:
+        np.ones(1024 ** 3, dtype=np.uint8)
+        connection.send((None, None, None, None))
+    except MemoryError:
+        connection.send((None, None, None, "MemoryError"))
+
+
+def start(target, *args):
+    # Forked, the test processes do not run TensorFlow
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=target, args=(sender,) + args, name="test-worker")
+    process.start()
+    sender.close()
+    return process, receiver
+
+
+class CpuSetsTest(unittest.TestCase):
+    def test_cpu_sets_are_disjoint(self):
+        cpu_sets = process_utils.get_cpu_sets(3, cpus=range(8))
+        self.assertEqual(cpu_sets, [[0, 1, 2], [3, 4, 5], [6, 7]])
+
+    def test_more_workers_than_cpus(self):
+        self.assertRaises(ValueError, process_utils.get_cpu_sets, 3, cpus=[0, 1])
+
+    def test_thread_pools_match_the_cpu_set(self):
+        kwargs = process_utils.get_worker_args([4, 5], {"cpu_cores": 8, "inter_threads": None, "intra_threads": None})
+        self.assertEqual((kwargs["cpu_cores"], kwargs["inter_threads"], kwargs["intra_threads"]), (2, 2, 2))
+        self.assertFalse(kwargs["report"])
+
+    def test_threads_are_pinned_to_the_first_cpus(self):
+        cpus = process_utils.get_available_cpus()
+        affinity = []
+
+        def run():
+            process_utils.pin_cpus(cpus, 1)
+            affinity.append(os.sched_getaffinity(0))
+
+        # The affinity is set per thread: the test thread keeps all of its CPUs
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        self.assertEqual(affinity, [{cpus[0]}])
+
+    def test_core_count_requires_pinning(self):
+        with unittest.mock.patch.object(process_utils, "os", unittest.mock.Mock(spec=[])):
+            self.assertRaises(ValueError, process_utils.pin_cpus, [0, 1], 1)
+            process_utils.pin_cpus([0, 1])
+
+    def test_cpu_pinning_is_required(self):
+        with unittest.mock.patch.object(process_utils, "os", unittest.mock.Mock(spec=[])):
+            self.assertRaises(ValueError, process_utils.run_parallel, 2, test_ids=["1", "2"])
+
+
+class MergeResultsTest(unittest.TestCase):
+    def test_tests_are_split_round_robin(self):
+        self.assertEqual(process_utils.split_tests(["1", "2", "3", "4", "5"], 2), [["1", "3", "5"], ["2", "4"]])
+
+    def test_results_are_merged_in_test_order(self):
+        benchmark_results, public_results, collector = process_utils.merge_results([
+            get_worker_results(["1", "11"], 1.),
+            get_worker_results(["2"], 2.),
+        ])
+
+        self.assertEqual(list(public_results.test_results), ["1.1", "2.1", "11.1"])
+        self.assertEqual(sorted(benchmark_results.results_inference_norm), [1., 1., 2.])
+        self.assertEqual([row["row1"] for row in collector], ["hardware", "TF Build", "1", "11", "2"])
+
+
+class IsolationTest(unittest.TestCase):
+    def test_hung_worker_times_out(self):
+        process, receiver = start(hang)
+        self.assertRaises(TimeoutError, process_utils.receive_results, process, receiver, 0.1)
+        process_utils.stop_worker(process)
+        self.assertFalse(process.is_alive())
+
+    def test_crashed_worker(self):
+        process, receiver = start(crash)
+        with self.assertRaisesRegex(RuntimeError, "exited with code 3"):
+            process_utils.receive_results(process, receiver)
+
+    def test_memory_limit(self):
+        process, receiver = start(allocate, 256)
+        with self.assertRaisesRegex(RuntimeError, "MemoryError"):
+            process_utils.receive_results(process, receiver)
+        process.join()
+
+    @unittest.mock.patch.dict('sys.modules', {'resource': None})
+    def test_memory_limit_requires_resource(self):
+        with self.assertRaisesRegex(ValueError, "resource module"):
+            process_utils.run_isolated(test_ids=["1"], memory_limit=256)
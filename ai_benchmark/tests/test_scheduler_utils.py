@@ -0,0 +1,53 @@
+import time
+import unittest
+import numpy as np
+from ai_benchmark import scheduler_utils
+
+
+def run(scheduler, sample):
+    samples = []
+    while scheduler.should_run(samples):
+        samples.append(sample(len(samples)))
+    return samples
+
+
+class IterationSchedulerTest(unittest.TestCase):
+    def test_fixed_iterations(self):
+        scheduler = scheduler_utils.IterationScheduler(22, 5, 30, 100)
+        self.assertEqual(len(run(scheduler, lambda i: 10)), 22)
+
+    def test_min_passes_after_max_duration(self):
+        scheduler = scheduler_utils.IterationScheduler(22, 5, 0, 100)
+        self.assertEqual(len(run(scheduler, lambda i: 10)), 5)
+
+
+class AdaptiveSchedulerTest(unittest.TestCase):
+    def test_stable_samples_converge_quickly(self):
+        scheduler = scheduler_utils.AdaptiveScheduler(5, 30, 100, target_ci=0.05)
+        self.assertEqual(len(run(scheduler, lambda i: 10 + 0.01 * (i % 2))), 5)
+
+    def test_noisy_samples_get_more_iterations(self):
+        rng = np.random.default_rng(0)
+        scheduler = scheduler_utils.AdaptiveScheduler(5, 30, 100, target_ci=0.05)
+        self.assertGreater(len(run(scheduler, lambda i: rng.uniform(5, 15))), 20)
+
+    def test_time_budget(self):
+        scheduler = scheduler_utils.AdaptiveScheduler(5, 0, 100, target_ci=0)
+        self.assertEqual(len(run(scheduler, lambda i: i)), 5)
+
+
+class WatchdogTest(unittest.TestCase):
+    def test_iterations_are_timed(self):
+        with scheduler_utils.Watchdog(5) as watchdog:
+            self.assertGreaterEqual(watchdog.run(lambda: time.sleep(0.01)), 10)
+
+    def test_slow_iteration_times_out(self):
+        with scheduler_utils.Watchdog(0.05) as watchdog:
+            self.assertRaises(TimeoutError, watchdog.run, lambda: time.sleep(0.5))
+            self.assertTrue(watchdog.is_running())
+            self.assertTrue(watchdog.wait(5))
+
+    def test_no_timeout_runs_inline(self):
+        with scheduler_utils.Watchdog() as watchdog:
+            self.assertIsNone(watchdog.calls)
+            self.assertGreaterEqual(watchdog.run(lambda: None), 0)
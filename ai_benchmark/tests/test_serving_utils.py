@@ -0,0 +1,129 @@
+import time
+import numpy as np
+import unittest
+from ai_benchmark import config
+from ai_benchmark import serving_utils
+from ai_benchmark import utils
+
+
+class BatchSweepTest(unittest.TestCase):
+    def test_batch_sizes(self):
+        self.assertEqual(serving_utils.get_batch_sizes(50), [1, 2, 4, 8, 16, 32, 64, 100])
+        self.assertEqual(serving_utils.get_batch_sizes(2), [1, 2, 4])
+
+    def test_sweep_test_does_not_modify_the_config(self):
+        sweep_test = serving_utils.get_sweep_test(config.MOBILENET_V2, [1, 100])
+        self.assertEqual([subTest.batch_size for subTest in sweep_test.inference], [1, 100])
+        self.assertEqual(sweep_test.inference[1].ref_time, 150)
+        self.assertEqual(config.MOBILENET_V2.inference[0].batch_size, 50)
+
+    def test_saturation_point(self):
+        sweep_test = serving_utils.get_sweep_test(config.MOBILENET_V2, [1, 2, 4, 8])
+        public_results = utils.PublicResults()
+        for sub_id, mean in enumerate([10., 10., 10.5, 20.], 1):
+            public_results.test_results["1.%d" % sub_id] = utils.Result(mean, 0.)
+
+        sweep = serving_utils.get_sweep_results([sweep_test], public_results)["1"]
+        self.assertEqual(sweep["throughput"], [100, 200, 4000 / 10.5, 400])
+        self.assertEqual(sweep["saturation"], 4)
+
+
+class StreamsTest(unittest.TestCase):
+    def test_streams_run_concurrently_until_stopped(self):
+        run_request = unittest.mock.Mock(side_effect=lambda stream: time.sleep(0.001))
+        latencies, samples, duration = serving_utils.run_streams(run_request, 3, lambda samples: len(samples) < 30)
+
+        # Every stream runs the whole budget
+        self.assertEqual([len(stream_latencies) for stream_latencies in latencies], [30, 30, 30])
+        self.assertEqual(sum(len(stream_latencies) for stream_latencies in latencies), len(samples))
+        self.assertEqual({call[0][0] for call in run_request.call_args_list}, {0, 1, 2})
+
+    def test_errors_are_raised(self):
+        run_request = unittest.mock.Mock(side_effect=RuntimeError("OOM"))
+        self.assertRaises(RuntimeError, serving_utils.run_streams, run_request, 2, lambda samples: True)
+
+    def test_stream_stats(self):
+        stats = serving_utils.get_stream_stats([[10., 10.], [20., 20.]], 2., batch_size=5)
+        self.assertEqual(stats["throughput"], 10)
+        self.assertEqual(stats["latency"]["p50"], 15)
+        self.assertEqual(stats["stream_latency"][1], {"p50": 20, "p90": 20, "p99": 20, "requests": 2})
+
+
+class LoadTest(unittest.TestCase):
+    def test_poisson_arrivals(self):
+        arrival_times = serving_utils.get_arrival_times(np.random.default_rng(1), 100., 20)
+        self.assertEqual(len(arrival_times), 2000)
+        self.assertTrue(np.all(np.diff(arrival_times) >= 0))
+        self.assertAlmostEqual(arrival_times[-1], 20, delta=2)
+
+    def test_latencies_include_queueing(self):
+        # All the requests are due at once: each one also waits for the ones served before it
+        run_request = unittest.mock.Mock(side_effect=lambda stream: time.sleep(0.01))
+        latencies, duration = serving_utils.run_open_loop(run_request, np.zeros(5), workers=1)
+
+        self.assertEqual(run_request.call_count, 5)
+        self.assertGreaterEqual(latencies[-1], 50)
+        self.assertTrue(np.all(np.diff(latencies) > 0))
+
+    def test_drain_is_capped(self):
+        # Requests still queued once the drain is over are dropped, not served
+        run_request = unittest.mock.Mock(side_effect=lambda stream: time.sleep(0.05))
+        latencies, elapsed = serving_utils.run_open_loop(run_request, np.zeros(20), workers=1, max_drain=0.1)
+
+        self.assertLess(run_request.call_count, 20)
+        self.assertEqual(np.isnan(latencies).sum(), 20 - run_request.call_count)
+        self.assertLess(elapsed, 0.5)
+
+    def test_knee(self):
+        load_curve = [{"qps": 10, "p99": 5.}, {"qps": 20, "p99": 8.}, {"qps": 30, "p99": 40.}, {"qps": 40, "p99": 9.}]
+        self.assertEqual(serving_utils.get_knee(load_curve), 20)
+        load_curve[1]["dropped"] = 3
+        self.assertEqual(serving_utils.get_knee(load_curve), 10)
+
+    def test_load_test(self):
+        run_request = unittest.mock.Mock()
+        load_curve = serving_utils.run_load_test(run_request, [200., 100.], duration=0.1, workers=2)
+
+        self.assertEqual([point["qps"] for point in load_curve["points"]], [100., 200.])
+        self.assertEqual(set(load_curve["points"][0]), {"qps", "throughput", "dropped", "p50", "p90", "p99"})
+        self.assertIsNotNone(load_curve["knee"])
+
+
+class DynamicBatchingTest(unittest.TestCase):
+    def test_policies(self):
+        self.assertEqual(serving_utils.get_batching_policies(2, timeouts=[5]), [(1, 5), (2, 5)])
+        self.assertEqual(len(serving_utils.get_batching_policies(50)), 8)
+
+    def test_queued_requests_are_batched(self):
+        # Requests due at once fill the batches up to max_batch without waiting for the timeout
+        run_batch = unittest.mock.Mock()
+        latencies, batch_sizes, duration = serving_utils.run_dynamic_batching(run_batch, np.zeros(10), 4, 1000)
+
+        self.assertEqual(sum(batch_sizes), 10)
+        self.assertLessEqual(max(batch_sizes), 4)
+        self.assertLess(duration, 1)
+        self.assertFalse(np.isnan(latencies).any())
+
+    def test_partial_batches_wait_for_the_timeout(self):
+        run_batch = unittest.mock.Mock()
+        latencies, batch_sizes, duration = serving_utils.run_dynamic_batching(run_batch, np.array([0, 0.2]), 8, 50)
+
+        self.assertEqual(batch_sizes, [1, 1])
+        self.assertGreaterEqual(latencies[0], 50)
+
+    def test_drain_is_capped(self):
+        run_batch = unittest.mock.Mock(side_effect=lambda size: time.sleep(0.05))
+        latencies, batch_sizes, elapsed = serving_utils.run_dynamic_batching(run_batch, np.zeros(20), 1, 0,
+                                                                             max_drain=0.1)
+
+        self.assertLess(sum(batch_sizes), 20)
+        self.assertEqual(np.isnan(latencies).sum(), 20 - sum(batch_sizes))
+
+    def test_batching_test(self):
+        run_batch = unittest.mock.Mock()
+        batching = serving_utils.run_batching_test(run_batch, 100., [(1, 1), (4, 5)], duration=0.1)
+
+        self.assertEqual(batching["qps"], 100.)
+        self.assertEqual([(result["max_batch"], result["timeout"]) for result in batching["policies"]],
+                         [(1, 1), (4, 5)])
+        self.assertEqual(batching["policies"][0]["mean_batch"], 1)
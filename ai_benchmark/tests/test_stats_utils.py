@@ -0,0 +1,42 @@
+import unittest
+import numpy as np
+from ai_benchmark import stats_utils
+
+
+class ComputeStatisticsTest(unittest.TestCase):
+    def test_warmup_is_detected(self):
+        samples = [300, 150, 80] + [50, 51, 49, 50, 52, 48, 50, 51, 49, 50]
+        stats = stats_utils.compute_statistics(samples, mser=True)
+        self.assertEqual(stats.warmup, 3)
+        self.assertAlmostEqual(stats.mean, 50, places=0)
+
+    def test_warmup_detection_is_opt_in(self):
+        samples = [300, 150, 80] + [50, 51, 49, 50, 52, 48, 50, 51, 49, 50]
+        stats = stats_utils.compute_statistics(samples)
+        self.assertEqual(stats.warmup, 1)
+        self.assertEqual(stats.mean, np.mean(samples[1:]))
+
+    def test_first_sample_is_always_dropped(self):
+        stats = stats_utils.compute_statistics([10, 10, 10, 10], mser=True)
+        self.assertEqual(stats.warmup, 1)
+
+    def test_percentiles_and_confidence_interval(self):
+        samples = np.r_[100, np.arange(1, 101)]
+        stats = stats_utils.compute_statistics(samples)
+        self.assertEqual(stats.p50, np.percentile(samples[stats.warmup:], 50))
+        self.assertLessEqual(stats.p50, stats.p90)
+        self.assertLessEqual(stats.p90, stats.p99)
+        self.assertLess(stats.ci_low, stats.mean)
+        self.assertGreater(stats.ci_high, stats.mean)
+
+    def test_outlier_rejection(self):
+        samples = [50, 50, 51, 49, 50, 500, 50, 51, 49, 50]
+        self.assertGreater(stats_utils.compute_statistics(samples).mean, 90)
+        stats = stats_utils.compute_statistics(samples, outlier_rejection=True)
+        self.assertEqual(stats.outliers, 1)
+        self.assertAlmostEqual(stats.mean, 50, places=0)
+
+    def test_empty_samples(self):
+        stats = stats_utils.compute_statistics([])
+        self.assertTrue(np.isnan(stats.mean))
+        self.assertTrue(np.isnan(stats.p99))
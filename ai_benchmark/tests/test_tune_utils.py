@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from ai_benchmark import tune_utils
+
+
+def get_result(mean):
+    result = unittest.mock.Mock()
+    result.mean = mean
+    return result
+
+
+class CandidatesTest(unittest.TestCase):
+    def test_thread_candidates(self):
+        self.assertEqual(tune_utils.get_thread_candidates(6), [1, 2, 4, 6, 12])
+        self.assertEqual(tune_utils.get_thread_candidates(1), [1, 2])
+
+    def test_inter_threads_do_not_exceed_cores(self):
+        candidates = tune_utils.get_candidates(2, intra_threads=[2])
+        self.assertEqual([c["inter_threads"] for c in candidates], [1, 2])
+
+
+class TuneThreadsTest(unittest.TestCase):
+    def test_best_latency_and_throughput_per_test(self):
+        # MobileNet-V2: batch of 50 for inference, 1 for micro
+        timings = {1: (10., 400.), 2: (12., 200.)}
+
+        def run(profile, micro, **kwargs):
+            intra = profile["1"]["intra_threads"]
+            results = unittest.mock.Mock()
+            results.test_results = {"1.1": get_result(timings[intra][0 if micro else 1])}
+            return None, results, []
+
+        candidates = tune_utils.get_candidates(1, intra_threads=[1, 2])
+        tuned = tune_utils.tune_threads(run, candidates, test_ids=["1"])
+
+        self.assertEqual(tuned["1"]["latency"]["intra_threads"], 1)
+        self.assertEqual(tuned["1"]["throughput"]["intra_threads"], 2)
+        self.assertEqual(tuned["1"]["throughput"]["samples_per_sec"], 250)
+
+    def test_profile_round_trip(self):
+        tuned = {"1": {"model": "MobileNet-V2",
+                       "latency": {"cpu_cores": 4, "inter_threads": 1, "intra_threads": 4, "time_ms": 5.}}}
+        with tempfile.TemporaryDirectory() as root:
+            file_path = os.path.join(root, "profile.json")
+            tune_utils.save_profile(file_path, tuned, {"cpu": "test"})
+            self.assertEqual(tune_utils.load_profile(file_path, "latency"),
+                             {"1": {"cpu_cores": 4, "inter_threads": 1, "intra_threads": 4}})
+            self.assertEqual(tune_utils.load_profile(file_path, "throughput"), {})
@@ -1,5 +1,7 @@
 import os
+import time
 import unittest
+import numpy as np
 from ai_benchmark import utils
 
 
@@ -17,3 +19,159 @@ class RunTestsTest(unittest.TestCase):
             start_dir=os.path.dirname(__file__),
         )
         self.assertTrue(mock_run.called)
+
+    @unittest.mock.patch('ai_benchmark.utils.CANCEL_TIMEOUT', 0)
+    @unittest.mock.patch('tensorflow.python.client.session.Session.close')
+    @unittest.mock.patch('tensorflow.python.client.session.Session.run')
+    def test_timed_out_call_still_running(self, mock_run, mock_close):
+        # The timed runs ignore their deadline, like the calls that cannot be cancelled
+        mock_run.side_effect = lambda *args, **kwargs: time.sleep(1) if kwargs.get("options") else None
+        _, public_results, _ = utils.run_tests(
+            training=True,
+            inference=True,
+            micro=False,
+            verbose=0,
+            use_cpu=None,
+            precision='normal',
+            _type="full",
+            start_dir=os.path.dirname(__file__),
+            test_ids=["1"],
+            iteration_timeout=0.1,
+            report=False,
+        )
+        timed_runs = [call for call in mock_run.call_args_list if call[1].get("options") is not None]
+        self.assertEqual(len(timed_runs), 1)
+        self.assertGreater(len(public_results.test_results), 1)
+        self.assertTrue(all(result.timed_out for result in public_results.test_results.values()))
+        self.assertFalse(mock_close.called)
+
+    # The eager thread pools of this process may already be set up by the other tests
+    @unittest.mock.patch('ai_benchmark.utils.set_function_options')
+    def test_engine_is_recorded(self, mock_set_function_options):
+        _, public_results, _ = utils.run_tests(
+            training=False,
+            inference=True,
+            micro=False,
+            verbose=0,
+            use_cpu=None,
+            precision='dry',
+            _type="full",
+            start_dir=os.path.dirname(__file__),
+            test_ids=["1"],
+            engine="function",
+            report=False,
+        )
+        self.assertEqual(set(result.engine for result in public_results.test_results.values()), {"function"})
+
+    def test_timeout_requires_a_single_stream(self):
+        with self.assertRaisesRegex(ValueError, "single-stream"):
+            utils.run_tests(training=False, inference=True, micro=False, verbose=0, use_cpu=None, precision='normal',
+                            _type="inference", start_dir=os.path.dirname(__file__), streams=2, iteration_timeout=1)
+
+
+class LoadTargetsTest(unittest.TestCase):
+    def test_one_hot_targets(self):
+        targets = utils.load_targets("classification", [50, 1001])
+        self.assertEqual(targets.dtype, np.float32)
+        np.testing.assert_array_equal(targets.sum(axis=1), np.ones(50))
+
+    def test_enhancement_targets_share_the_inputs(self):
+        data_cache = utils.DataCache()
+        with unittest.mock.patch('ai_benchmark.utils.load_image_batches', wraps=utils.load_image_batches) as loader:
+            data, targets = utils.get_batch(data_cache, "enhancement", [2, 64, 64, 3], [2, 128, 128, 3])
+            self.assertEqual(loader.call_count, 1)
+        self.assertEqual(targets.shape, (2, 128, 128, 3))
+        self.assertIs(utils.get_targets(data_cache, "enhancement", [2, 64, 64, 3]), data)
+
+
+class PhaseTimerTest(unittest.TestCase):
+    def test_nested_phases_are_not_counted_twice(self):
+        timer = utils.PhaseTimer()
+        with unittest.mock.patch('ai_benchmark.utils.get_time_ns', side_effect=[0, 1e6, 3e6, 10e6]):
+            with timer.phase("graph_import"):
+                with timer.phase("optimizer"):
+                    pass
+        self.assertEqual(timer.times["optimizer"], 2)
+        self.assertEqual(timer.times["graph_import"], 8)
+
+    def test_first_iteration_is_warmup(self):
+        timer = utils.PhaseTimer()
+        timer.add_samples(np.array([10., 2., 3.]))
+        timer.add_samples(np.array([]))
+        self.assertEqual(timer.times["warmup"], 10)
+        self.assertEqual(timer.times["steady_state"], 5)
+
+
+class CompareResultsTest(unittest.TestCase):
+    def test_speedup_and_compile_time(self):
+        baseline, optimized = utils.PublicResults(), utils.PublicResults()
+        baseline.test_results["1.1"] = utils.Result(20., 1., np.array([50., 20., 20.]))
+        optimized.test_results["1.1"] = utils.Result(10., 1., np.array([450., 10., 10.]))
+
+        comparison = utils.compare_results(baseline, optimized)
+        self.assertEqual(comparison["1.1"]["speedup"], 2)
+        self.assertEqual(comparison["1.1"]["compile_time"], 400)
+
+
+class JournalConfigTest(unittest.TestCase):
+    def test_results_depend_on_the_scheduling_settings(self):
+        testInfo = unittest.mock.Mock()
+        config = utils.get_journal_config(testInfo, True, True, False, True, "feed", None, target_ci=0.05, seed=42)
+        self.assertNotEqual(utils.get_journal_config(testInfo, True, True, False, True, "feed", None, target_ci=0.01,
+                                                     seed=42), config)
+
+        with unittest.mock.patch.object(utils.TestConstructor.BENCHMARK_TESTS[0].inference[0], "max_duration", 1):
+            self.assertNotEqual(utils.get_journal_config(testInfo, True, True, False, True, "feed", None,
+                                                         target_ci=0.05, seed=42), config)
+
+    @unittest.mock.patch('ai_benchmark.utils.get_gpu_models', return_value=[["Test GPU", "8.0"]])
+    def test_environment_includes_the_gpus(self, mock_gpu_models):
+        self.assertEqual(utils.get_environment()["gpu"], ["Test GPU"])
+
+
+class ScoresTest(unittest.TestCase):
+    def print_scores(self, non_reference=(), timed_out=False):
+        testInfo = unittest.mock.Mock(_type="inference", non_reference=list(non_reference), failed_tests={})
+        testInfo.results = utils.BenchmarkResults()
+        testInfo.results.results_inference_norm = [1.]
+        public_results = utils.PublicResults()
+        public_results.test_results["1.1"] = utils.Result(10., 1.)
+        public_results.test_results["1.1"].timed_out = timed_out
+        utils.print_scores(testInfo, public_results)
+
+    @unittest.mock.patch('ai_benchmark.utils.update_info')
+    def test_reference_scores_are_uploaded(self, mock_update_info):
+        self.print_scores()
+        mock_update_info.assert_called_once()
+
+    @unittest.mock.patch('ai_benchmark.utils.update_info')
+    def test_other_scores_are_not_uploaded(self, mock_update_info):
+        self.print_scores(non_reference=["synthetic"])
+        self.print_scores(timed_out=True)
+        self.assertFalse(mock_update_info.called)
+
+    def test_non_reference_settings(self):
+        self.assertEqual(utils.get_non_reference_settings({"streams": 1, "grappler": {"layout": "default"}}), [])
+        self.assertEqual(utils.get_non_reference_settings({"synthetic": True, "grappler": {"layout": "off"}}),
+                         ["synthetic", "grappler"])
+
+
+class RestoreTestTest(unittest.TestCase):
+    def test_journaled_results_count_in_the_scores(self):
+        test = utils.TestConstructor().get_tests(["1"])[0]
+        finished_test = {
+            "subtests": [
+                {"public_id": "1.1", "kind": "inference", "norm": 2., "result": vars(utils.Result(10., 1., [9., 11.]))},
+                {"public_id": "1.2", "kind": "training", "norm": None, "result": vars(utils.Result(np.nan, np.nan, []))},
+            ],
+            "phase_times": {"warmup": 9.},
+        }
+        benchmark_results, public_results = utils.BenchmarkResults(), utils.PublicResults()
+        utils.restore_test(test, finished_test, benchmark_results, public_results)
+
+        self.assertEqual(list(public_results.test_results), ["1.1", "1.2"])
+        np.testing.assert_array_equal(public_results.test_results["1.1"].samples, [9., 11.])
+        self.assertEqual(benchmark_results.results_inference_norm, [2.])
+        self.assertEqual(benchmark_results.results_training_norm, [])
+        self.assertEqual(public_results.phase_times["1"], {"warmup": 9.})
+        self.assertTrue(public_results.test_results["1.1"].restored)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019-2020 by Andrey Ignatov. All Rights Reserved.
+
+import json
+import logging
+from os import path
+
+from ai_benchmark.config import TestConstructor
+from ai_benchmark.io_utils import write_atomic
+
+PROFILE_VERSION = 1
+OBJECTIVES = ("latency", "throughput")
+DEFAULT_PROFILE = "ai_benchmark_profile.json"
+# Seconds of adaptive iterations per subtest and candidate
+DEFAULT_TUNE_BUDGET = 3
+INTER_THREAD_CANDIDATES = (1, 2, 4, 8)
+THREAD_SETTINGS = ("cpu_cores", "inter_threads", "intra_threads")
+
+logger = logging.getLogger('ai_benchmark')
+
+
+def get_thread_candidates(cpu_cores):
+    # Powers of two below the core count, the core count itself and the former default of twice as many
+    candidates = {cpu_cores, cpu_cores * 2}
+    threads = 1
+    while threads < cpu_cores:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+
+def get_candidates(cpu_cores, core_counts=None, inter_threads=None, intra_threads=None):
+    candidates = []
+    for cores in core_counts or [cpu_cores]:
+        for inter in inter_threads or [n for n in INTER_THREAD_CANDIDATES if n <= cores]:
+            for intra in intra_threads or get_thread_candidates(cores):
+                candidates.append({"cpu_cores": cores, "inter_threads": inter, "intra_threads": intra})
+    return candidates
+
+
+def get_subtest_means(test, public_results, subtests):
+    # Subtests are numbered from 1 for each test in the order they were run
+    means = []
+    for sub_id, subTest in enumerate(subtests, 1):
+        result = public_results.test_results.get("%d.%d" % (test.id, sub_id))
+        if result is not None and result.mean > 0:
+            means.append((subTest, result.mean))
+    return means
+
+
+def get_latency(test, micro_results, inference_results):
+    # Single-sample micro subtests measure latency, tests without them fall back to the full batches
+    means = get_subtest_means(test, micro_results, test.micro) or \
+        get_subtest_means(test, inference_results, test.inference)
+    if not means:
+        return None
+    return sum(mean for subTest, mean in means) / len(means)
+
+
+def get_throughput(test, inference_results):
+    means = get_subtest_means(test, inference_results, test.inference)
+    if not means:
+        return None
+    return 1000. * sum(subTest.batch_size for subTest, mean in means) / sum(mean for subTest, mean in means)
+
+
+def tune_threads(run, candidates, test_ids=None, time_budget=DEFAULT_TUNE_BUDGET, **kwargs):
+
+    tests = TestConstructor().get_tests(test_ids)
+    best = {}
+
+    for candidate in candidates:
+
+        logger.warning("Tuning: %d cores, %d inter-op threads, %d intra-op threads",
+                       candidate["cpu_cores"], candidate["inter_threads"], candidate["intra_threads"])
+
+        thread_profile = dict((str(test.id), candidate) for test in tests)
+        _, micro_results, _ = run(test_ids=test_ids, training=False, inference=False, micro=True, adaptive=True,
+                                  time_budget=time_budget, profile=thread_profile, **kwargs)
+        _, inference_results, _ = run(test_ids=test_ids, training=False, inference=True, micro=False, adaptive=True,
+                                      time_budget=time_budget, profile=thread_profile, **kwargs)
+
+        for test in tests:
+            entry = best.setdefault(str(test.id), {"model": test.model})
+
+            latency = get_latency(test, micro_results, inference_results)
+            if latency is not None and ("latency" not in entry or latency < entry["latency"]["time_ms"]):
+                entry["latency"] = dict(candidate, time_ms=latency)
+
+            throughput = get_throughput(test, inference_results)
+            if throughput is not None and ("throughput" not in entry or
+                                           throughput > entry["throughput"]["samples_per_sec"]):
+                entry["throughput"] = dict(candidate, samples_per_sec=throughput)
+
+    return best
+
+
+def print_tuned_profile(tuned):
+    for test_id, entry in tuned.items():
+        logger.info("\n%s. %s", test_id, entry["model"])
+        if "latency" in entry:
+            logger.info("%s - best latency | cores=%d, inter=%d, intra=%d: %.2f ms", test_id,
+                        *[entry["latency"][key] for key in THREAD_SETTINGS + ("time_ms",)])
+        if "throughput" in entry:
+            logger.info("%s - best throughput | cores=%d, inter=%d, intra=%d: %.1f samples/s", test_id,
+                        *[entry["throughput"][key] for key in THREAD_SETTINGS + ("samples_per_sec",)])
+
+
+def save_profile(file_path, tuned, environment):
+    profile = {
+        "version": PROFILE_VERSION,
+        "environment": environment,
+        "tests": tuned,
+    }
+    write_atomic(file_path, lambda f: json.dump(profile, f, indent=4), mode="w")
+    logger.info("Thread profile saved to %s", file_path)
+
+
+def load_profile(file_path, objective="throughput", environment=None):
+
+    if objective not in OBJECTIVES:
+        raise ValueError("Unknown profile objective: %s" % objective)
+
+    with open(path.expanduser(file_path)) as f:
+        profile = json.load(f)
+
+    if profile.get("version") != PROFILE_VERSION:
+        raise ValueError("Unsupported thread profile version: %s" % profile.get("version"))
+    if environment is not None and profile.get("environment") != environment:
+        logger.warning("Thread profile %s was tuned on a different system", file_path)
+
+    return dict(
+        (test_id, dict((key, entry[objective][key]) for key in THREAD_SETTINGS))
+        for test_id, entry in profile["tests"].items() if objective in entry
+    )
@@ -10,19 +10,54 @@ import cpuinfo
 import time
 import multiprocessing
 import logging
+from contextlib import contextmanager
 
 from psutil import virtual_memory
 import numpy as np
 import tensorflow as tf
 from tensorflow.python.client import device_lib
 from pkg_resources import parse_version
-from PIL import Image
 
 from ai_benchmark.update_utils import update_info
 from ai_benchmark.config import TestConstructor
+from ai_benchmark.data_utils import DataCache, DatasetStore, Prefetcher, DEFAULT_CACHE_SIZE_MB
+from ai_benchmark.data_utils import IMAGE_TEST_TYPES, SHARED_TARGET_TYPES, NLP_TEXT
+from ai_benchmark.data_utils import generate_data, generate_targets
+from ai_benchmark.data_utils import get_image_paths, load_image_batch, load_image_batches
+from ai_benchmark.stats_utils import compute_statistics
+from ai_benchmark.scheduler_utils import IterationScheduler, AdaptiveScheduler, Watchdog, DEFAULT_TARGET_CI
+from ai_benchmark.scheduler_utils import get_time_ns
+from ai_benchmark.graph_utils import MetaGraphCache, get_placeholder_signature
+from ai_benchmark.graph_utils import set_graph_options, set_function_options, wrap_frozen_graph, FunctionCall
+from ai_benchmark.graph_utils import create_staged_input, create_input, get_tensor, is_staged, next_feed_dict
+from ai_benchmark.serving_utils import get_sweep_test, run_streams, get_stream_stats, print_stream_stats, \
+    DEFAULT_LOAD_DURATION, get_load_rates, run_load_test, print_load_curve, BATCHING_LOAD, get_sweep_subtest, \
+    get_batching_policies, run_batching_test, print_batching_results
+from ai_benchmark.journal_utils import Journal
+from ai_benchmark.process_utils import get_available_cpus, pin_cpus
 from ai_benchmark.models import *
 
 MAX_TEST_DURATION = 100
+# Seconds a session run past its deadline gets to be cancelled before it is given up on
+CANCEL_TIMEOUT = 1
+SETUP_PHASES = ("graph_import", "initialization", "optimizer", "warmup", "steady_state")
+# Run settings of the public ranking: the scores of the other runs are printed, not uploaded
+REFERENCE_SETTINGS = {
+    "synthetic": False,
+    "outlier_rejection": False,
+    "detect_warmup": False,
+    "adaptive": False,
+    "input_mode": "feed",
+    "thread_profile": None,
+    "xla": False,
+    "grappler": None,
+    "frozen": False,
+    "engine": "session",
+    "batch_sweep": False,
+    "streams": 1,
+    "load_test": False,
+    "batching": False,
+}
 resultCollector=[]
 
 logger = logging.getLogger('ai_benchmark')
@@ -43,9 +78,28 @@ class BenchmarkResults:
 
 
 class Result:
-    def __init__(self, mean, std):
+    def __init__(self, mean, std, samples=None, stats=None):
         self.mean = mean
         self.std = std
+        self.samples = samples
+
+        self.p50 = self.p90 = self.p99 = None
+        self.ci = None
+        self.warmup = None
+        self.outliers = None
+        self.streams = None
+        self.load = None
+        self.batching = None
+        self.timed_out = False
+        self.restored = False
+        # Engine that actually ran the subtest, the function engine falls back to sessions
+        self.engine = "session"
+
+        if stats is not None:
+            self.p50, self.p90, self.p99 = stats.p50, stats.p90, stats.p99
+            self.ci = [stats.ci_low, stats.ci_high]
+            self.warmup = stats.warmup
+            self.outliers = stats.outliers
 
 
 class PublicResults:
@@ -56,6 +110,8 @@ class PublicResults:
         self.inference_score = None
         self.training_score = None
 
+        self.phase_times = {}
+
 
 class TestInfo:
     def __init__(self, _type, precision, use_cpu, verbose, cpu_cores, inter_threads, intra_threads):
@@ -79,116 +135,151 @@ class TestInfo:
         self.verbose_level = verbose
         self.results = None
         self.path = path.dirname(__file__)
+        # Settings and failures that make the scores incomparable with the public ranking
+        self.non_reference = []
+        self.failed_tests = {}
 
 
-def get_time_seconds():
-    return int(time.time())
+class PhaseTimer:
+    """Wall time in ms spent by a test in each setup and measurement phase"""
+    def __init__(self):
+        self.times = dict((phase, 0.) for phase in SETUP_PHASES)
+        self._nested = []
+
+    @contextmanager
+    def phase(self, name):
+        # Time spent in a nested phase is only accounted to the innermost one
+        self._nested.append(0)
+        time_started = get_time_ns()
+        try:
+            yield
+        finally:
+            elapsed = (get_time_ns() - time_started) / 1e6
+            self.add(name, elapsed - self._nested.pop())
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def add(self, name, time_ms):
+        self.times[name] = self.times.get(name, 0.) + time_ms
+
+    def add_samples(self, samples):
+        # The first iteration also pays for the lazy graph setup done by TensorFlow
+        if len(samples):
+            self.add("warmup", float(samples[0]))
+            self.add("steady_state", float(np.sum(samples[1:])))
+
+
+def load_data(test_type, dimensions, dtype=np.float32):
 
+    data = None
+    if test_type in IMAGE_TEST_TYPES:
+        data = load_image_batch(get_image_paths(test_type, dimensions[0]), dimensions, dtype)
 
-def get_time_ms():
-    return int(round(time.time() * 1000))
+    if test_type == "nlp":
+        data = np.random.uniform(-4, 4, (dimensions[0], dimensions[1], dimensions[2])).astype(dtype)
 
+    if test_type == "nlp-text":
+        data = NLP_TEXT
 
-def resize_image(image, dimensions):
+    return data
 
-    image = np.asarray(image)
 
-    height = image.shape[0]
-    width = image.shape[1]
+def load_targets(test_type, dimensions, dtype=np.float32):
 
-    aspect_ratio_image = float(width) / height
-    aspect_ratio_target = float(dimensions[1]) / dimensions[0]
+    data = None
+    if test_type == "classification" or test_type == "nlp":
 
-    if aspect_ratio_target == aspect_ratio_image:
-        image = Image.fromarray(image).resize((dimensions[1], dimensions[0]))
+        data = np.zeros(dimensions, dtype=dtype)
+        data[np.arange(dimensions[0]), np.random.randint(dimensions[1], size=dimensions[0])] = 1
 
-    elif aspect_ratio_image < aspect_ratio_target:
-        new_height = int(float(width) / aspect_ratio_target)
-        offset = int((height - new_height) / 2)
-        image = image[offset:offset + new_height, :, :]
-        image = Image.fromarray(image).resize((dimensions[1], dimensions[0]))
+    if test_type == "enhancement":
+        data = load_image_batch(get_image_paths(test_type, dimensions[0]), dimensions, dtype)
 
-    else:
-        new_width = int(float(height) * aspect_ratio_target)
-        offset = int((width - new_width) / 2)
-        image = image[:, offset:offset + new_width, :]
-        image = Image.fromarray(image).resize((dimensions[1], dimensions[0]))
+    if test_type == "segmentation":
+        data = load_image_batch(get_image_paths(test_type, dimensions[0], "_segmented"), dimensions, dtype)
 
-    return image
+    return data
 
 
-def load_data(test_type, dimensions):
+def get_cache_key(kind, test_type, dimensions, dtype):
+    return kind, test_type, tuple(dimensions), np.dtype(dtype).str
 
-    data = None
-    if test_type == "classification":
 
-        data = np.zeros(dimensions)
-        for j in range(dimensions[0]):
+def get_data(data_cache, test_type, dimensions, dtype=np.float32, data_store=None, rng=None):
 
-            image = Image.open(path.join(path.dirname(__file__), "data/classification/" + str(j) + ".jpg"))
-            image = resize_image(image, [dimensions[1], dimensions[2]])
-            data[j] = image
+    if rng is not None:
+        return data_cache.get(get_cache_key("synthetic-data", test_type, dimensions, dtype),
+                              lambda: generate_data(rng, test_type, dimensions, dtype), pinned=True)
 
-    if test_type == "enhancement":
+    def loader():
+        if data_store is None:
+            return load_data(test_type, dimensions, dtype)
+        return data_store.load("data", test_type, dimensions, dtype,
+                               lambda: load_data(test_type, dimensions, dtype))
 
-        data = np.zeros(dimensions)
-        for j in range(dimensions[0]):
-            image = Image.open(path.join(path.dirname(__file__), "data/enhancement/" + str(j) + ".jpg"))
-            image = resize_image(image, [dimensions[1], dimensions[2]])
-            data[j] = image
+    return data_cache.get(get_cache_key("data", test_type, dimensions, dtype), loader)
 
-    if test_type == "segmentation":
 
-        data = np.zeros(dimensions)
-        for j in range(dimensions[0]):
-            image = Image.open(path.join(path.dirname(__file__), "data/segmentation/" + str(j) + ".jpg"))
-            image = resize_image(image, [dimensions[1], dimensions[2]])
-            data[j] = image
+def get_targets(data_cache, test_type, dimensions, dtype=np.float32, data_store=None, rng=None):
 
-    if test_type == "nlp":
-        data = np.random.uniform(-4, 4, (dimensions[0], dimensions[1], dimensions[2]))
+    # Enhancement targets are the input images themselves
+    if test_type in SHARED_TARGET_TYPES:
+        return get_data(data_cache, test_type, dimensions, dtype, data_store, rng)
 
-    if test_type == "nlp-text":
-        data = "This is a story of how a Baggins had an adventure, " \
-               "and found himself doing and saying things altogether unexpected."
+    if rng is not None:
+        return data_cache.get(get_cache_key("synthetic-targets", test_type, dimensions, dtype),
+                              lambda: generate_targets(rng, test_type, dimensions, dtype), pinned=True)
 
-    return data
+    def loader():
+        if data_store is None:
+            return load_targets(test_type, dimensions, dtype)
+        return data_store.load("targets", test_type, dimensions, dtype,
+                               lambda: load_targets(test_type, dimensions, dtype))
 
+    return data_cache.get(get_cache_key("targets", test_type, dimensions, dtype), loader)
 
-def load_targets(test_type, dimensions):
 
-    data = None
-    if test_type == "classification" or test_type == "nlp":
+def get_batch(data_cache, test_type, input_dims, output_dims, dtype=np.float32, data_store=None, rng=None):
 
-        data = np.zeros(dimensions)
-        for j in range(dimensions[0]):
-            data[j, np.random.randint(dimensions[1])] = 1
+    # Inputs and targets of a different size made from the same images are
+    # resized from a single decode pass instead of decoding every file twice
+    if test_type in SHARED_TARGET_TYPES and data_store is None and rng is None \
+            and list(input_dims) != list(output_dims):
 
-    if test_type == "enhancement":
+        data_key = get_cache_key("data", test_type, input_dims, dtype)
+        targets_key = get_cache_key("data", test_type, output_dims, dtype)
 
-        data = np.zeros(dimensions)
-        for j in range(dimensions[0]):
-            image = Image.open(path.join(path.dirname(__file__), "data/enhancement/" + str(j) + ".jpg"))
-            image = resize_image(image, [dimensions[1], dimensions[2]])
-            data[j] = image
+        if data_key not in data_cache and targets_key not in data_cache:
+            data, targets = load_image_batches(get_image_paths(test_type, input_dims[0]), [input_dims, output_dims], dtype)
+            data_cache.put(data_key, data)
+            data_cache.put(targets_key, targets)
+            return data, targets
 
-    if test_type == "enhancement":
+    return get_data(data_cache, test_type, input_dims, dtype, data_store, rng), \
+        get_targets(data_cache, test_type, output_dims, dtype, data_store, rng)
 
-        data = np.zeros(dimensions)
-        for j in range(dimensions[0]):
-            image = Image.open(path.join(path.dirname(__file__), "data/enhancement/" + str(j) + ".jpg"))
-            image = resize_image(image, [dimensions[1], dimensions[2]])
-            data[j] = image
 
-    if test_type == "segmentation":
+def prepare_data_store(data_store, test_ids=None):
 
-        data = np.zeros(dimensions)
-        for j in range(dimensions[0]):
-            image = Image.open(path.join(path.dirname(__file__), "data/segmentation/" + str(j) + "_segmented.jpg"))
-            image = resize_image(image, [dimensions[1], dimensions[2]])
-            data[j] = image
+    # Only the largest batch of each image size is written, smaller ones are its slices
+    batches = {}
+    for test in TestConstructor().get_tests(test_ids):
+        for subTest in test.training + test.inference + test.micro:
+            dims = [("data", subTest.get_input_dims())]
+            if subTest in test.training:
+                dims.append(("data" if test.type in SHARED_TARGET_TYPES else "targets", subTest.get_output_dims()))
+            for kind, dimensions in dims:
+                if data_store.is_stored(kind, test.type):
+                    key = (kind, test.type, tuple(dimensions[1:]))
+                    batches[key] = max(batches.get(key, 0), dimensions[0])
 
-    return data
+    for (kind, test_type, size), batch_size in sorted(batches.items()):
+        dimensions = [batch_size] + list(size)
+        if kind == "data":
+            get_data(DataCache(0), test_type, dimensions, data_store=data_store)
+        else:
+            get_targets(DataCache(0), test_type, dimensions, data_store=data_store)
+        logger.info("Data store: %s %s %s ready", test_type, kind, "x".join(str(d) for d in dimensions))
 
 
 def construct_optimizer(sess, output_, target_, loss_function, optimizer, learning_rate, tf_ver_2):
@@ -212,48 +303,179 @@ def construct_optimizer(sess, output_, target_, loss_function, optimizer, learni
     return train_step
 
 
-def get_model_src(test, testInfo, session):
+def can_freeze(test, testInfo):
+    # Lookup tables of the nlp-text models are filled by init ops that freezing would drop
+    return not (testInfo.tf_ver_2 and test.use_src) and test.type != "nlp-text"
+
+
+def get_concrete_function(test, testInfo, graph_cache):
+
+    # Only frozen graphs are wrapped, variables of imported meta graphs would not be tracked by the function
+    graph_def = graph_cache.load_frozen(test.model_src) if testInfo.tf_ver_2 and can_freeze(test, testInfo) else None
+    if graph_def is None:
+        logger.warning("%s cannot be frozen and is run with the session engine", test.model)
+        return None
+
+    return wrap_frozen_graph(graph_def, device="/CPU:0" if testInfo.is_cpu_inference else None)
+
+
+def get_model_src(test, testInfo, session, input_mode="feed", graph_cache=None, timer=None):
 
     train_vars = None
+    graph_cache = graph_cache or MetaGraphCache()
+    timer = timer or PhaseTimer()
 
     if testInfo.tf_ver_2 and test.use_src:
 
         # Bypassing TensorFlow 2.0+ RNN Bugs
 
         if test.model == "LSTM-Sentiment":
-            input_ = tf.compat.v1.placeholder(tf.float32, [None, 1024, 300], name="input")
-            output_ = LSTM_Sentiment(input_)
+            input_ = create_input(tf.float32, [None, 1024, 300], input_mode, name="input")
+            output_ = LSTM_Sentiment(get_tensor(input_))
 
         if test.model == "Pixel-RNN":
-            input_ = tf.compat.v1.placeholder(tf.float32, [None, 64, 64, 3], name="input")
-            output_ = PixelRNN(input_)
+            input_ = create_input(tf.float32, [None, 64, 64, 3], input_mode, name="input")
+            output_ = PixelRNN(get_tensor(input_))
 
-        target_ = tf.compat.v1.placeholder(tf.float32, test.training[0].get_output_dims())
+        target_ = create_input(tf.float32, test.training[0].get_output_dims(), input_mode, staged_name="staged_target")
 
-        train_step_ = construct_optimizer(session, output_, target_,  test.training[0].loss_function,
-                                        test.training[0].optimizer,  test.training[0].learning_rate, testInfo.tf_ver_2)
+        with timer.phase("optimizer"):
+            train_step_ = construct_optimizer(session, output_, get_tensor(target_),  test.training[0].loss_function,
+                                            test.training[0].optimizer,  test.training[0].learning_rate, testInfo.tf_ver_2)
 
         train_vars = [target_, train_step_]
 
     else:
 
-        if testInfo.tf_ver_2:
-            tf.compat.v1.train.import_meta_graph(test.model_src, clear_devices=True)
+        frozen = testInfo.frozen and can_freeze(test, testInfo)
+
+        # Cached graphs are parsed once per process and have their devices already cleared
+        graph_def = graph_cache.load_frozen(test.model_src) if frozen else None
+        if graph_def is None:
+            if frozen:
+                logger.debug("%s updates its variables during inference and is run unfrozen", test.model)
+            frozen = False
+            meta_graph_def = graph_cache.load(test.model_src)
+            graph_def = meta_graph_def.graph_def
+
+        # In graph mode the input placeholder is replaced with a variable holding the staged batch
+        staged_input, input_map = None, None
+        if input_mode == "graph":
+            staged_input = create_staged_input(*get_placeholder_signature(graph_def))
+            if staged_input is not None:
+                input_map = {'input:0': staged_input.value}
+
+        if frozen:
+            import_graph_def = tf.compat.v1.import_graph_def if testInfo.tf_ver_2 else tf.import_graph_def
+            import_graph_def(graph_def, input_map=input_map, name="")
+            g = tf.compat.v1.get_default_graph() if testInfo.tf_ver_2 else tf.get_default_graph()
+        elif testInfo.tf_ver_2:
+            tf.compat.v1.train.import_meta_graph(meta_graph_def, input_map=input_map)
             g = tf.compat.v1.get_default_graph()
         else:
-            tf.train.import_meta_graph(test.model_src, clear_devices=True)
+            tf.train.import_meta_graph(meta_graph_def, input_map=input_map)
             g = tf.get_default_graph()
 
-        input_ = g.get_tensor_by_name('input:0')
+        input_ = staged_input if staged_input is not None else g.get_tensor_by_name('input:0')
         output_ = g.get_tensor_by_name('output:0')
 
     return input_, output_, train_vars
 
 
-def compute_stats(results):
-    if len(results) > 1:
-        results = results[1:]
-    return np.mean(results), np.std(results)
+def get_stream_requests(sess, input_, output_, function_, load_batch, streams):
+
+    # Every stream runs the same session or function with its own copy of the batch
+    def get_stream_batch():
+        return [data.copy() if isinstance(data, np.ndarray) else data for data in load_batch()]
+
+    if function_ is not None:
+        calls = [FunctionCall(function_, "graph") for stream in range(streams)]
+        for call in calls:
+            call.set_batch(get_stream_batch())
+        run_request = lambda stream: calls[stream]()
+    else:
+        feed_dicts = [{get_tensor(input_): get_stream_batch()[0]} for stream in range(streams)]
+        run_request = lambda stream: sess.run(output_, feed_dict=feed_dicts[stream])
+
+    return run_request
+
+
+def run_inference_streams(sess, input_, output_, function_, load_batch, scheduler, streams):
+    run_request = get_stream_requests(sess, input_, output_, function_, load_batch, streams)
+    latencies, samples, duration = run_streams(run_request, streams, scheduler.should_run)
+    return np.asarray(samples), latencies, duration
+
+
+def run_inference_load(sess, input_, output_, function_, load_batch, capacity, workers=1, load_qps=None,
+                       load_duration=DEFAULT_LOAD_DURATION, seed=42):
+    # Offered loads default to fractions of the closed-loop capacity measured just before
+    rates = load_qps or get_load_rates(capacity)
+    run_request = get_stream_requests(sess, input_, output_, function_, load_batch, workers)
+    return run_load_test(run_request, rates, load_duration, workers, seed)
+
+
+def run_inference_batching(sess, input_, output_, function_, load_batch, rate, policies,
+                           load_duration=DEFAULT_LOAD_DURATION, seed=42):
+
+    # Batches of any size up to the largest policy are slices of one preloaded batch
+    data = load_batch(max(max_batch for max_batch, timeout in policies))[0]
+    if function_ is not None:
+        call = FunctionCall(function_)
+        run_batch = lambda size: call.run([data[:size]])
+    else:
+        run_batch = lambda size: sess.run(output_, feed_dict={get_tensor(input_): data[:size]})
+    return run_batching_test(run_batch, rate, policies, load_duration, seed)
+
+
+def compute_stats(results, outlier_rejection=False):
+    stats = compute_statistics(results, outlier_rejection)
+    return stats.mean, stats.std
+
+
+def print_test_stats(prefix, stats):
+    logger.debug("%s | p50=%.2f, p90=%.2f, p99=%.2f ms, 95%% CI=[%.2f, %.2f] ms, warmup=%d, outliers=%d",
+                 prefix, stats.p50, stats.p90, stats.p99, stats.ci_low, stats.ci_high, stats.warmup, stats.outliers)
+
+
+def get_scheduler(subTest, precision, iter_multiplier, adaptive=False, target_ci=DEFAULT_TARGET_CI, time_budget=None,
+                  mser=False):
+
+    if adaptive and precision != "dry":
+        return AdaptiveScheduler(subTest.min_passes, time_budget or subTest.max_duration, MAX_TEST_DURATION, target_ci,
+                                 mser=mser)
+
+    return IterationScheduler(subTest.iterations * iter_multiplier, subTest.min_passes, subTest.max_duration,
+                              MAX_TEST_DURATION, run_all=(precision == "high"))
+
+
+def add_skipped_subtest(test, sub_id, kind, public_results, journal):
+    # Reported and left out of the scores like the timed-out subtests
+    public_id = "%d.%d" % (test.id, sub_id)
+    public_results.test_results[public_id] = Result(np.nan, np.nan, np.asarray([]))
+    public_results.test_results[public_id].timed_out = True
+    logger.warning("%s - skipped, a timed-out call of this test is still running", public_id)
+    if journal is not None:
+        journal.add_subtest(test.id, public_id, kind, public_results.test_results[public_id], None)
+
+
+@contextmanager
+def open_session(session, watchdogs):
+    """Enters the session like `with session`, but leaves it open while a call given up on still runs in it"""
+    with session.graph.as_default(), session.as_default():
+        try:
+            yield session
+        finally:
+            if any(watchdog.is_running() for watchdog in watchdogs):
+                logger.warning("A timed-out call is still running, its session is left open")
+            else:
+                session.close()
+
+
+def print_phase_times(test_id, phase_times):
+    logger.info("%s - setup | graph import: %.0f ms, initialization: %.0f ms, optimizer: %.0f ms, "
+                "warmup: %.0f ms, steady state: %.0f ms", test_id, phase_times["graph_import"],
+                phase_times["initialization"], phase_times["optimizer"], phase_times["warmup"],
+                phase_times["steady_state"])
 
 
 def print_test_results(prefix, batch_size, dimensions, mean, std):
@@ -343,6 +565,17 @@ def get_num_cpu_cores():
         return -1
 
 
+def get_environment():
+    # Identifies the systems whose tuned settings and results are interchangeable
+    return {
+        "cpu": get_cpu_model(),
+        "cpu_cores": get_num_cpu_cores(),
+        "platform": get_platform_info(),
+        "tf_version": get_tf_version(),
+        "gpu": [gpu_model for gpu_model, gpu_ram in get_gpu_models()],
+    }
+
+
 def get_cpu_ram():
     try:
         return str(round(virtual_memory().total / (1024. ** 3)))
@@ -406,11 +639,39 @@ def get_cuda_info():
     return cuda_version, cuda_build
 
 
-def print_scores(testInfo, public_results):
+def get_non_reference_settings(settings):
+    non_reference = []
+    for name, value in REFERENCE_SETTINGS.items():
+        setting = settings.get(name, value)
+        if name == "grappler" and setting:
+            setting = dict((key, toggle) for key, toggle in setting.items() if toggle != "default") or None
+        if setting != value:
+            non_reference.append(name)
+    return non_reference
+
+
+def get_unreported_reasons(testInfo, public_results):
+    reasons = list(testInfo.non_reference)
+    if any(result.timed_out for result in public_results.test_results.values()):
+        reasons.append("timed-out subtests")
+    if any(result.restored for result in public_results.test_results.values()):
+        reasons.append("journaled results")
+    if testInfo.failed_tests:
+        reasons.append("failed tests")
+    return reasons
+
+
+def print_scores(testInfo, public_results, report=True):
 
     c_inference = 10000
     c_training = 10000
 
+    if report:
+        reasons = get_unreported_reasons(testInfo, public_results)
+        if reasons:
+            logger.info("The scores are not uploaded, the run differs from the reference: %s", ", ".join(reasons))
+            report = False
+
     if testInfo._type == "full":
 
         inference_score = geometrical_mean(testInfo.results.results_inference_norm)
@@ -429,7 +690,8 @@ def print_scores(testInfo, public_results):
         testInfo.results.ai_score = testInfo.results.inference_score + testInfo.results.training_score
         public_results.ai_score = testInfo.results.ai_score
 
-        update_info("scores", testInfo)
+        if report:
+            update_info("scores", testInfo)
 
         logger.info("Device Inference Score: %s", testInfo.results.inference_score)
         logger.info("Device Training Score: %s", testInfo.results.training_score)
@@ -443,7 +705,8 @@ def print_scores(testInfo, public_results):
 
         public_results.inference_score = testInfo.results.inference_score
 
-        update_info("scores", testInfo)
+        if report:
+            update_info("scores", testInfo)
 
         logger.info("Device Inference Score: %s", testInfo.results.inference_score)
         logger.info("For more information and results, please visit http://ai-benchmark.com/alpha\n")
@@ -455,7 +718,8 @@ def print_scores(testInfo, public_results):
 
         public_results.training_score = testInfo.results.training_score
 
-        update_info("scores", testInfo)
+        if report:
+            update_info("scores", testInfo)
 
         logger.info("Device Training Score: %s", testInfo.results.training_score)
         logger.info("For more information and results, please visit http://ai-benchmark.com/alpha\n")
@@ -467,7 +731,8 @@ def print_scores(testInfo, public_results):
 
         public_results.inference_score = testInfo.results.inference_score
 
-        update_info("scores", testInfo)
+        if report:
+            update_info("scores", testInfo)
 
         logger.info("Device Inference Score: %s", testInfo.results.inference_score)
         logger.info("For more information and results, please visit http://ai-benchmark.com/alpha\n")
@@ -475,6 +740,71 @@ def print_scores(testInfo, public_results):
     return public_results
 
 
+def get_session_config(testInfo, use_cpu, cpu_cores, inter_threads, intra_threads, per_session_threads=False):
+
+    ConfigProto = tf.compat.v1.ConfigProto if testInfo.tf_ver_2 else tf.ConfigProto
+    if use_cpu:
+        config = ConfigProto(
+            device_count={'GPU': 0, 'CPU': cpu_cores},
+            inter_op_parallelism_threads=inter_threads,
+            intra_op_parallelism_threads=intra_threads,
+            use_per_session_threads=per_session_threads,
+        )
+    elif per_session_threads:
+        config = ConfigProto(
+            inter_op_parallelism_threads=inter_threads,
+            intra_op_parallelism_threads=intra_threads,
+            use_per_session_threads=True,
+        )
+    elif testInfo.xla or testInfo.grappler:
+        config = ConfigProto()
+    else:
+        return None
+
+    return set_graph_options(config, testInfo.xla, testInfo.grappler)
+
+
+def get_test_config(testInfo, use_cpu, thread_profile, test):
+    # Tests missing from the profile keep the thread settings of the run
+    threads = thread_profile.get(str(test.id))
+    if threads is None:
+        return get_session_config(testInfo, use_cpu, testInfo.cpu_cores, testInfo.inter_threads,
+                                  testInfo.intra_threads, per_session_threads=True)
+    return get_session_config(testInfo, use_cpu, threads["cpu_cores"], threads["inter_threads"],
+                              threads["intra_threads"], per_session_threads=True)
+
+
+def compare_results(baseline, optimized):
+
+    comparison = {}
+    for public_id, result in optimized.test_results.items():
+        reference = baseline.test_results.get(public_id)
+        if reference is None or not result.mean or not reference.mean:
+            continue
+
+        # Graph rewriting and XLA compilation happen on the first run of each subtest
+        compile_time = None
+        if result.samples is not None and reference.samples is not None \
+                and len(result.samples) and len(reference.samples):
+            compile_time = float(result.samples[0] - reference.samples[0])
+
+        comparison[public_id] = {
+            "baseline": reference.mean,
+            "optimized": result.mean,
+            "speedup": reference.mean / result.mean,
+            "compile_time": compile_time,
+        }
+    return comparison
+
+
+def print_comparison(comparison):
+    logger.info("")
+    for public_id, entry in comparison.items():
+        compile_time = "N/A" if entry["compile_time"] is None else "%.0f ms" % entry["compile_time"]
+        logger.info("%s - speedup | baseline: %.1f ms, optimized: %.1f ms, speedup: %.2fx, extra compile time: %s",
+                    public_id, entry["baseline"], entry["optimized"], entry["speedup"], compile_time)
+
+
 def geometrical_mean(results):
     results = np.asarray(results)
     try:
@@ -483,6 +813,49 @@ def geometrical_mean(results):
         return np.nan
 
 
+def get_max_durations():
+    # Time limits of every subtest, which cap the iterations of the long-running ones
+    return dict((str(test.id), [subTest.max_duration for subTest in test.training + test.inference + test.micro])
+                for test in TestConstructor.BENCHMARK_TESTS)
+
+
+def get_journal_config(testInfo, training, inference, micro, adaptive, input_mode, batch_sizes, **settings):
+    # Settings the journaled results depend on
+    config = dict((key, getattr(testInfo, key)) for key in (
+        "precision", "is_cpu_inference", "cpu_cores", "inter_threads", "intra_threads", "synthetic", "thread_profile",
+        "xla", "grappler", "frozen", "engine", "batch_sweep", "streams", "iteration_timeout"))
+    config.update(training=training, inference=inference, micro=micro, adaptive=adaptive, input_mode=input_mode,
+                  batch_sizes=batch_sizes, max_test_duration=MAX_TEST_DURATION, max_durations=get_max_durations(),
+                  **settings)
+    return config
+
+
+def restore_result(data):
+    result = Result(data["mean"], data["std"])
+    result.__dict__.update(data)
+    result.samples = np.asarray(result.samples)
+    return result
+
+
+def restore_test(test, finished_test, benchmark_results, public_results):
+
+    for record in finished_test["subtests"]:
+        result = restore_result(record["result"])
+        result.restored = True
+        public_results.test_results[record["public_id"]] = result
+        if record["norm"] is not None:
+            if record["kind"] == "training":
+                benchmark_results.results_training.append(result.mean)
+                benchmark_results.results_training_norm.append(record["norm"])
+            else:
+                benchmark_results.results_inference.append(result.mean)
+                benchmark_results.results_inference_norm.append(record["norm"])
+        logger.info("%s - %s | %.1f ms, from the journal", record["public_id"], record["kind"], result.mean)
+        collectResults(test, record["public_id"], None, None, result.mean, result.std)
+
+    public_results.phase_times[str(test.id)] = finished_test["phase_times"]
+
+
 def run_tests(
         training,
         inference,
@@ -496,23 +869,114 @@ def run_tests(
         cpu_cores=None,
         inter_threads=None,
         intra_threads=None,
+        cache_size=None,
+        data_store=None,
+        prefetch=0,
+        synthetic=False,
+        seed=42,
+        outlier_rejection=False,
+        detect_warmup=False,
+        adaptive=False,
+        target_ci=DEFAULT_TARGET_CI,
+        time_budget=None,
+        input_mode="feed",
+        graph_cache=None,
+        thread_profile=None,
+        xla=False,
+        grappler=None,
+        frozen=False,
+        engine="session",
+        batch_sweep=False,
+        batch_sizes=None,
+        streams=1,
+        load_test=False,
+        load_qps=None,
+        load_duration=DEFAULT_LOAD_DURATION,
+        batching=False,
+        batching_qps=None,
+        max_batches=None,
+        batch_timeouts=None,
+        iteration_timeout=None,
+        journal=None,
+        resume=False,
+        report=True,
     ):
 
+    if frozen and training:
+        raise ValueError("Frozen graphs can only be used for inference-only runs")
+    if engine == "function" and training:
+        raise ValueError("The function engine can only be used for inference-only runs")
+    if iteration_timeout and (streams > 1 or load_test or batching):
+        raise ValueError("The iteration timeout only applies to single-stream runs, not to streams, load or batching")
+    if engine == "function" and thread_profile is not None:
+        raise ValueError("The function engine cannot apply thread profiles, its thread pools are shared by the process")
+
     # print(test_ids)
     testInfo = TestInfo(_type, precision, use_cpu, verbose, cpu_cores, inter_threads, intra_threads)
     testInfo.full_suite = (
         test_ids is None or
         len(test_ids) == len(TestConstructor.BENCHMARK_TESTS)
     )
+    testInfo.synthetic = synthetic
+    testInfo.thread_profile = thread_profile
+    testInfo.xla = xla
+    testInfo.grappler = grappler
+    testInfo.frozen = frozen
+    testInfo.engine = engine
+    testInfo.batch_sweep = batch_sweep
+    testInfo.streams = streams
+    testInfo.load_test = load_test
+    testInfo.batching = batching
+    testInfo.iteration_timeout = iteration_timeout
+    testInfo.non_reference = get_non_reference_settings(dict(
+        synthetic=synthetic, outlier_rejection=outlier_rejection, detect_warmup=detect_warmup, adaptive=adaptive,
+        input_mode=input_mode, thread_profile=thread_profile, xla=xla, grappler=grappler, frozen=frozen,
+        engine=engine, batch_sweep=batch_sweep, streams=streams, load_test=load_test, batching=batching))
+
+    # TensorFlow shares one intra-op thread pool per process, sized by the first session,
+    # unless the pools are created per session: needed to apply different settings per test
+    if thread_profile is not None:
+        os.environ.setdefault("TF_OVERRIDE_GLOBAL_THREADPOOL", "1")
+    # Sessions take these settings from their config, the concrete functions from the eager runtime
+    if engine == "function":
+        if testInfo.tf_ver_2:
+            set_function_options(testInfo.inter_threads, testInfo.intra_threads, xla, grappler)
+        else:
+            logger.warning("The function engine requires TensorFlow 2, the tests are run with the session engine")
 
-    print_test_info(testInfo)
+    # Partial runs, e.g. the tests of one worker process, leave the banner and the uploads to the caller
+    if report:
+        print_test_info(testInfo)
     init_resultCollector(testInfo)
 
     time.sleep(1)
 
     benchmark_tests = TestConstructor().get_tests(test_ids)
+    # Sweeps replace the inference subtests with a range of batch sizes
+    if batch_sweep:
+        benchmark_tests = [get_sweep_test(test, batch_sizes) for test in benchmark_tests]
     benchmark_results = BenchmarkResults()
     public_results = PublicResults()
+    data_cache = DataCache(DEFAULT_CACHE_SIZE_MB if cache_size is None else cache_size)
+    if data_store is not None and not synthetic:
+        data_store = DatasetStore(data_store)
+    else:
+        data_store = None
+
+    graph_cache = MetaGraphCache(graph_cache)
+
+    # Finished subtests are journaled as they complete, resumed runs skip the tests journaled with the same settings
+    finished_tests = {}
+    if journal is not None:
+        journal_config = get_journal_config(testInfo, training, inference, micro, adaptive, input_mode, batch_sizes,
+                                            target_ci=target_ci, time_budget=time_budget, seed=seed,
+                                            outlier_rejection=outlier_rejection, detect_warmup=detect_warmup)
+        journal = Journal(journal, get_environment(), journal_config)
+        if resume:
+            finished_tests = journal.load()
+
+    # Synthetic batches are generated once per shape and never touch the image files
+    rng = np.random.default_rng(seed) if synthetic else None
     os.chdir(path.dirname(__file__))
 
     iter_multiplier = {
@@ -521,127 +985,258 @@ def run_tests(
         "high": 10,
     }.get(precision, 1)
 
-    ConfigProto = tf.compat.v1.ConfigProto if testInfo.tf_ver_2 else tf.ConfigProto
-    if use_cpu:
-        config = ConfigProto(
-            device_count={'GPU': 0, 'CPU': testInfo.cpu_cores},
-            inter_op_parallelism_threads=testInfo.inter_threads,
-            intra_op_parallelism_threads=testInfo.intra_threads,
-        )
-    else:
-        config = None
+    # Session runs are cancelled past the deadline, the watchdog also covers the calls that ignore it
+    run_options = tf.compat.v1.RunOptions(timeout_in_ms=int(iteration_timeout * 1000)) if iteration_timeout else None
+
+    config = get_session_config(testInfo, use_cpu, testInfo.cpu_cores, testInfo.inter_threads, testInfo.intra_threads)
+    # device_count does not limit the cores: the tests of a profile are pinned to as many CPUs
+    run_cpus = get_available_cpus() if thread_profile is not None else None
 
     for test in benchmark_tests:
 
         if not (micro and len(test.micro) == 0):
             logger.info("\n%s/%s. %s\n", test.id, len(benchmark_tests), test.model)
-        sub_id = 1
-
-        tf.compat.v1.reset_default_graph() if testInfo.tf_ver_2 else tf.reset_default_graph()
-        session = tf.compat.v1.Session(config=config) if testInfo.tf_ver_2 else tf.Session(config=config)
 
-        with tf.Graph().as_default(), session as sess:
+        if str(test.id) in finished_tests:
+            restore_test(test, finished_tests[str(test.id)], benchmark_results, public_results)
+            continue
+        if journal is not None:
+            journal.start_test(test.id)
 
-            input_, output_, train_vars_ = get_model_src(test, testInfo, sess)
+        sub_id = 1
+        timer = PhaseTimer()
 
-            if testInfo.tf_ver_2:
-                tf.compat.v1.global_variables_initializer().run()
-                if test.type == "nlp-text":
-                    sess.run(tf.compat.v1.tables_initializer())
-            else:
-                tf.global_variables_initializer().run()
-                if test.type == "nlp-text":
-                    sess.run(tf.tables_initializer())
+        tf.compat.v1.reset_default_graph() if testInfo.tf_ver_2 else tf.reset_default_graph()
+        test_config = config if thread_profile is None else get_test_config(testInfo, use_cpu, thread_profile, test)
+        if run_cpus is not None:
+            pin_cpus(run_cpus, thread_profile.get(str(test.id), {}).get("cpu_cores"))
+        session = tf.compat.v1.Session(config=test_config) if testInfo.tf_ver_2 else tf.Session(config=test_config)
+
+        # Watchdogs that gave up on a call still running: the rest of the test is skipped rather than overlap it
+        abandoned = []
+
+        with tf.Graph().as_default(), open_session(session, abandoned) as sess:
+
+            with timer.phase("graph_import"):
+                function_ = get_concrete_function(test, testInfo, graph_cache) if engine == "function" else None
+                if function_ is None:
+                    input_, output_, train_vars_ = get_model_src(test, testInfo, sess, input_mode, graph_cache, timer)
+                else:
+                    input_, output_, train_vars_ = None, None, None
+
+            with timer.phase("initialization"):
+                if testInfo.tf_ver_2:
+                    tf.compat.v1.global_variables_initializer().run()
+                    if test.type == "nlp-text":
+                        sess.run(tf.compat.v1.tables_initializer())
+                else:
+                    tf.global_variables_initializer().run()
+                    if test.type == "nlp-text":
+                        sess.run(tf.tables_initializer())
 
             if inference or micro:
 
                 for subTest in (test.inference if inference else test.micro):
 
-                    time_test_started = get_time_seconds()
-                    inference_times = []
-
-                    for i in range(subTest.iterations * iter_multiplier):
+                    if abandoned:
+                        add_skipped_subtest(test, sub_id, "inference", public_results, journal)
+                        sub_id += 1
+                        continue
 
-                        if get_time_seconds() - time_test_started < subTest.max_duration \
-                                or (i < subTest.min_passes and get_time_seconds() - time_test_started < MAX_TEST_DURATION) \
-                                or precision == "high":
+                    scheduler = get_scheduler(subTest, precision, iter_multiplier, adaptive, target_ci, time_budget,
+                                              detect_warmup)
+                    inference_times = []
 
-                            data = load_data(test.type, subTest.get_input_dims())
-                            time_iter_started = get_time_ms()
-                            sess.run(output_, feed_dict={input_: data})
-                            inference_time = get_time_ms() - time_iter_started
-                            inference_times.append(inference_time)
+                    load_batch = lambda: [get_data(data_cache, test.type, subTest.get_input_dims(),
+                                                   data_store=data_store, rng=rng)]
+                    feed_dict = None
+                    timed_out = False
+                    call = FunctionCall(function_, input_mode) if function_ is not None else None
+                    staged = call.staged if call is not None else is_staged([input_])
 
-                            logger.debug("Inference Time: %s ms", inference_time)
+                    watchdog = Watchdog(iteration_timeout)
+                    try:
+                        if streams > 1:
+                            inference_times, latencies, duration = run_inference_streams(
+                                sess, input_, output_, function_, load_batch, scheduler, streams)
+                            stream_stats = get_stream_stats(latencies, duration, subTest.batch_size)
 
-                    time_mean, time_std = compute_stats(inference_times)
+                        else:
+                            with Prefetcher(load_batch, 0 if staged else prefetch) as batches, watchdog:
+                                while scheduler.should_run(inference_times):
+
+                                    if call is None:
+                                        feed_dict = next_feed_dict(sess, [input_], batches, feed_dict)
+                                        inference_time = watchdog.run(
+                                            lambda: sess.run(output_, feed_dict=feed_dict, options=run_options))
+                                    else:
+                                        call.next_batch(batches)
+                                        inference_time = watchdog.run(call)
+
+                                    inference_times.append(inference_time)
+
+                                    logger.debug("Inference Time: %.3f ms", inference_time)
+                    except (TimeoutError, tf.errors.DeadlineExceededError):
+                        logger.warning("%d.%d - Iteration exceeded %g s, moving on to the next subtest",
+                                       test.id, sub_id, iteration_timeout)
+                        timed_out = True
+                        # Only the session runs are cancelled past the deadline
+                        if not watchdog.wait(CANCEL_TIMEOUT):
+                            abandoned.append(watchdog)
+                    except (tf.errors.ResourceExhaustedError, MemoryError):
+                        if not batch_sweep:
+                            raise
+                        logger.warning("%d.%d - batch=%d does not fit into memory, larger batches are skipped",
+                                       test.id, sub_id, subTest.batch_size)
+                        break
+
+                    inference_times = np.asarray(inference_times)
+                    timer.add_samples(inference_times)
+                    stats = compute_statistics(inference_times, outlier_rejection, mser=detect_warmup)
+                    time_mean, time_std = stats.mean, stats.std
 
                     public_id = "%d.%d" % (test.id, sub_id)
-                    public_results.test_results[public_id] = Result(time_mean, time_std)
-
-                    benchmark_results.results_inference.append(time_mean)
-                    benchmark_results.results_inference_norm.append(float(subTest.ref_time) / time_mean)
+                    public_results.test_results[public_id] = Result(time_mean, time_std, inference_times, stats)
+                    public_results.test_results[public_id].timed_out = timed_out
+                    if function_ is not None:
+                        public_results.test_results[public_id].engine = "function"
+                    measured = len(inference_times) > 0 and not timed_out
+                    if streams > 1:
+                        public_results.test_results[public_id].streams = stream_stats
+
+                    if load_test and measured:
+                        capacity = stream_stats["throughput"] / subTest.batch_size if streams > 1 else 1000. / time_mean
+                        load_curve = run_inference_load(sess, input_, output_, function_, load_batch, capacity,
+                                                        streams, load_qps, load_duration, seed)
+                        public_results.test_results[public_id].load = load_curve
+
+                    # Single-sample requests of the subtest inputs, GNMT only runs its fixed text batch
+                    run_batching = batching and measured and test.type != "nlp-text"
+                    if run_batching:
+                        throughput = stream_stats["throughput"] if streams > 1 else 1000. * subTest.batch_size / time_mean
+                        load_batches = lambda size: [get_data(data_cache, test.type,
+                                                              get_sweep_subtest(subTest, size).get_input_dims(),
+                                                              data_store=data_store, rng=rng)]
+                        batching_results = run_inference_batching(
+                            sess, input_, output_, function_, load_batches, batching_qps or throughput * BATCHING_LOAD,
+                            get_batching_policies(subTest.batch_size, max_batches, batch_timeouts), load_duration, seed)
+                        public_results.test_results[public_id].batching = batching_results
+
+                    # Timed-out subtests are reported, but left out of the scores
+                    norm = None if timed_out else float(subTest.ref_time) / time_mean
+                    if norm is not None:
+                        benchmark_results.results_inference.append(time_mean)
+                        benchmark_results.results_inference_norm.append(norm)
 
                     prefix = "%d.%d - inference" % (test.id, sub_id)
                     print_test_results(prefix, subTest.batch_size, subTest.get_input_dims(), time_mean, time_std)
+                    print_test_stats(prefix, stats)
+                    if streams > 1:
+                        print_stream_stats(prefix, stream_stats)
+                    if load_test and measured:
+                        print_load_curve(prefix, load_curve)
+                    if run_batching:
+                        print_batching_results(prefix, batching_results)
                     collectResults(test,prefix, subTest.batch_size, subTest.get_input_dims(), time_mean, time_std)
+                    if journal is not None:
+                        journal.add_subtest(test.id, public_id, "inference", public_results.test_results[public_id], norm)
                     sub_id += 1
 
             if training:
 
                 for subTest in test.training:
 
+                    if abandoned:
+                        add_skipped_subtest(test, sub_id, "training", public_results, journal)
+                        sub_id += 1
+                        continue
+
                     if train_vars_ is None:
 
-                        if testInfo.tf_ver_2:
+                        if input_mode == "graph":
+                            target_ = create_input(tf.float32, subTest.get_output_dims(), input_mode,
+                                                   staged_name="staged_target")
+                        elif testInfo.tf_ver_2:
                             target_ = tf.compat.v1.placeholder(tf.float32, subTest.get_output_dims())
                         else:
                             target_ = tf.placeholder(tf.float32, subTest.get_output_dims())
 
-                        train_step = construct_optimizer(sess, output_, target_, subTest.loss_function,
-                                                        subTest.optimizer, subTest.learning_rate, testInfo.tf_ver_2)
+                        with timer.phase("optimizer"):
+                            train_step = construct_optimizer(sess, output_, get_tensor(target_), subTest.loss_function,
+                                                            subTest.optimizer, subTest.learning_rate, testInfo.tf_ver_2)
 
                     else:
 
                         target_ = train_vars_[0]
                         train_step = train_vars_[1]
 
-                    time_test_started = get_time_seconds()
+                    scheduler = get_scheduler(subTest, precision, iter_multiplier, adaptive, target_ci, time_budget,
+                                              detect_warmup)
                     training_times = []
 
-                    for i in range(subTest.iterations * iter_multiplier):
+                    load_batch = lambda: get_batch(data_cache, test.type, subTest.get_input_dims(),
+                                                   subTest.get_output_dims(), data_store=data_store, rng=rng)
 
-                        if get_time_seconds() - time_test_started < subTest.max_duration \
-                                or (i < subTest.min_passes and get_time_seconds() - time_test_started < MAX_TEST_DURATION) \
-                                or precision == "high":
+                    feed_dict = None
+                    timed_out = False
 
-                            data = load_data(test.type, subTest.get_input_dims())
-                            target = load_targets(test.type, subTest.get_output_dims())
+                    watchdog = Watchdog(iteration_timeout)
+                    try:
+                        with Prefetcher(load_batch, 0 if is_staged([input_, target_]) else prefetch) as batches, \
+                                watchdog:
+                            while scheduler.should_run(training_times):
 
-                            time_iter_started = get_time_ms()
-                            sess.run(train_step, feed_dict={input_: data, target_: target})
-                            training_time = get_time_ms() - time_iter_started
-                            training_times.append(training_time)
+                                feed_dict = next_feed_dict(sess, [input_, target_], batches, feed_dict)
 
-                            logger.debug("Training Time: %s ms", training_time)
+                                training_time = watchdog.run(
+                                    lambda: sess.run(train_step, feed_dict=feed_dict, options=run_options))
+                                training_times.append(training_time)
 
-                    time_mean, time_std = compute_stats(training_times)
+                                logger.debug("Training Time: %.3f ms", training_time)
+                    except (TimeoutError, tf.errors.DeadlineExceededError):
+                        logger.warning("%d.%d - Iteration exceeded %g s, moving on to the next subtest",
+                                       test.id, sub_id, iteration_timeout)
+                        timed_out = True
+                        if not watchdog.wait(CANCEL_TIMEOUT):
+                            abandoned.append(watchdog)
+
+                    training_times = np.asarray(training_times)
+                    timer.add_samples(training_times)
+                    stats = compute_statistics(training_times, outlier_rejection, mser=detect_warmup)
+                    time_mean, time_std = stats.mean, stats.std
 
                     public_id = "%d.%d" % (test.id, sub_id)
-                    public_results.test_results[public_id] = Result(time_mean, time_std)
+                    public_results.test_results[public_id] = Result(time_mean, time_std, training_times, stats)
+                    public_results.test_results[public_id].timed_out = timed_out
 
-                    benchmark_results.results_training.append(time_mean)
-                    benchmark_results.results_training_norm.append(float(subTest.ref_time) / time_mean)
+                    norm = None if timed_out else float(subTest.ref_time) / time_mean
+                    if norm is not None:
+                        benchmark_results.results_training.append(time_mean)
+                        benchmark_results.results_training_norm.append(norm)
 
                     prefix = "%d.%d - training " % (test.id, sub_id)
                     print_test_results(prefix, subTest.batch_size, subTest.get_input_dims(), time_mean, time_std)
+                    print_test_stats(prefix, stats)
                     collectResults(test,prefix, subTest.batch_size, subTest.get_input_dims(), time_mean, time_std)
+                    if journal is not None:
+                        journal.add_subtest(test.id, public_id, "training", public_results.test_results[public_id], norm)
                     sub_id += 1
 
-        sess.close()
+        public_results.phase_times[str(test.id)] = timer.times
+        if journal is not None:
+            journal.add_test(test.id, timer.times)
+        print_phase_times(test.id, timer.times)
+
+        logger.debug("Data cache: %d hits, %d misses, %.1f MB used, %.1f MB pinned", data_cache.hits,
+                     data_cache.misses, data_cache.size / 1024. ** 2, data_cache.pinned_size / 1024. ** 2)
+        # The synthetic batches of a test are not kept for the next ones
+        data_cache.clear_pinned()
+
+    if run_cpus is not None:
+        pin_cpus(run_cpus)
 
     testInfo.results = benchmark_results
-    public_results = print_scores(testInfo, public_results)
+    public_results = print_scores(testInfo, public_results, report)
     finish_resultCollector(testInfo)
 
     os.chdir(start_dir)